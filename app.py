@@ -3,12 +3,19 @@ import io
 import re
 import time
 from datetime import datetime
+from pathlib import Path
 
 import streamlit as st
 import pandas as pd
 
-from classifier import PorotoclassifierLLM, OUTPUT_FIELDS, GROQ_MODELS
+from baseline import Baseline, ticket_fields
+from cache import ClassificationCache
+from classifier import PorotoclassifierLLM, OUTPUT_FIELDS, META_FIELDS, GROQ_MODELS
+from clustering import TitleClusters
+from examples_index import DEFAULT_PATH as EXAMPLES_PATH, ExampleIndex
+from local_model import DEFAULT_PATH as LOCAL_MODEL_PATH, DEFAULT_THRESHOLD, LocalModel
 from jira_client import JiraClient
+from metrics import RunMetrics
 
 st.set_page_config(
     page_title="Clasificador de Porotos TMO",
@@ -73,16 +80,8 @@ def parse_uploaded_csv(uploaded_file):
 def results_to_dataframe(results):
     records = []
     for r in results:
-        records.append({
-            "clave": r.get("key", ""),
-            "resumen": r.get("title", ""),
-            "ANTIGUEDAD": r.get("ANTIGUEDAD", ""),
-            "TIPO_DE_PRODUCTO": r.get("TIPO_DE_PRODUCTO", ""),
-            "SCOPE": r.get("SCOPE", ""),
-            "COMPLEJIDAD": r.get("COMPLEJIDAD", ""),
-            "SCOPE_REFINAMIENTO": r.get("SCOPE_REFINAMIENTO", ""),
-            "JUSTIFICACION": r.get("JUSTIFICACION", ""),
-        })
+        records.append({"clave": r.get("key", ""), "resumen": r.get("title", "")}
+                       | {f: r.get(f, "") for f in OUTPUT_FIELDS + META_FIELDS})
     return pd.DataFrame(records)
 
 
@@ -100,6 +99,22 @@ def color_antiguedad(val):
     return colors.get(val, "")
 
 
+@st.cache_resource
+def get_classification_cache():
+    return ClassificationCache(Path(__file__).resolve().parent / ".cache" / "clasificaciones.sqlite3")
+
+
+@st.cache_resource
+def get_example_index(mtime):
+    # mtime is only part of the cache key, so a rebuilt index is picked up.
+    return ExampleIndex.load(EXAMPLES_PATH)
+
+
+@st.cache_resource
+def get_local_model(mtime):
+    return LocalModel.load(LOCAL_MODEL_PATH)
+
+
 # ──────────────────────────────────────────────
 # Credentials
 # ──────────────────────────────────────────────
@@ -127,15 +142,35 @@ def render_sidebar():
 
         speed = st.radio(
             "Velocidad del modelo",
-            options=["⚡ Rápido (~2s/poroto)", "🎯 Preciso (~4s/poroto)"],
+            options=["⚡ Rápido (~2s/poroto)", "🎯 Preciso (~4s/poroto)", "🪜 Cascada (rápido + preciso)"],
             index=0,
-            help="Rápido usa un modelo más chico pero mucho más veloz. Preciso usa el modelo grande.",
+            help="Rápido usa un modelo más chico pero mucho más veloz. Preciso usa el modelo grande. "
+                 "Cascada usa el rápido y solo pasa al grande los porotos dudosos.",
         )
-        creds["model_speed"] = "fast" if "Rápido" in speed else "accurate"
+        creds["model_speed"] = "fast" if "Rápido" in speed else "accurate" if "Preciso" in speed else "cascade"
+        creds["workers"] = st.slider("Requests en paralelo", min_value=1, max_value=8, value=4,
+                                     help="Cuántos porotos se clasifican a la vez. El límite de requests del proveedor se respeta igual.")
+        creds["batch_size"] = st.slider("Porotos por request", min_value=1, max_value=10, value=1,
+                                        help="Agrupa varios porotos en un mismo prompt. Menos requests y tokens, a costa de algo de precisión.")
+        creds["compact"] = st.checkbox("Respuesta compacta", value=False,
+                                       help="El modelo responde con códigos cortos que se expanden acá. Respuestas más rápidas, justificaciones más breves.")
+        creds["stream"] = st.checkbox("Streaming", value=False,
+                                      help="Recibe las respuestas a medida que se generan y las corta apenas alcanzan. La tabla se llena antes.")
+        creds["cluster"] = st.checkbox("Agrupar casi duplicados", value=False,
+                                       help="Los porotos con el mismo título salvo sitio, tags o \"parte N\" se clasifican una sola vez. La columna CLUSTER indica de cuál se copió cada uno.")
+        if EXAMPLES_PATH.exists():
+            creds["examples"] = st.checkbox("Ejemplos similares", value=False,
+                                            help="En vez de los ejemplos fijos del prompt, cada poroto lleva los más parecidos ya clasificados en corridas anteriores.")
+        if LOCAL_MODEL_PATH.exists():
+            creds["local"] = st.checkbox("Modelo local", value=False,
+                                         help="Un modelo entrenado con corridas anteriores responde los porotos en los que tiene confianza; solo el resto va al LLM. Sin API key, responde todos.")
+            if creds["local"]:
+                creds["threshold"] = st.slider("Confianza mínima", min_value=0.5, max_value=0.99,
+                                               value=DEFAULT_THRESHOLD, step=0.01)
 
         with st.expander("API Keys", expanded=not creds["groq_key"]):
             groq_key = st.text_input("Groq API Key", value=creds["groq_key"], type="password",
-                                     help="Gratis en https://console.groq.com/keys")
+                                     help="Gratis en https://console.groq.com/keys. Podés poner varias separadas por coma para repartir el rate limit.")
             jira_email = st.text_input("Jira Email", value=creds["jira_email"])
             jira_token = st.text_input("Jira API Token", value=creds["jira_token"], type="password",
                                        help="https://id.atlassian.com/manage-profile/security/api-tokens")
@@ -146,8 +181,12 @@ def render_sidebar():
         st.divider()
         st.subheader("Estado")
         model_name = GROQ_MODELS.get(creds["model_speed"], "llama-3.1-8b-instant")
+        if creds["model_speed"] == "cascade":
+            model_name = f"{GROQ_MODELS['fast']} → {GROQ_MODELS['accurate']}"
         if creds["groq_key"]:
             st.success(f"LLM: {model_name}", icon="✅")
+        elif creds.get("local"):
+            st.warning("Sin API key: solo modelo local", icon="⚠️")
         else:
             st.error("Falta API key de LLM", icon="❌")
         if creds["jira_email"] and creds["jira_token"]:
@@ -166,19 +205,31 @@ def render_sidebar():
 # Classification
 # ──────────────────────────────────────────────
 
-def run_classification(porotos, creds):
-    if not creds.get("groq_key"):
+def run_classification(porotos, creds, baseline=None):
+    if not creds.get("groq_key") and not creds.get("local"):
         st.error("Configura la API key de Groq en el sidebar.")
         return None
 
     model = GROQ_MODELS.get(creds.get("model_speed", "fast"), "llama-3.1-8b-instant")
-    classifier = PorotoclassifierLLM(provider="groq", api_key=creds["groq_key"], model=model)
+    cache = get_classification_cache()
+    hits_before, misses_before = cache.hits, cache.misses
+    groq_keys = [k.strip() for k in creds["groq_key"].split(",") if k.strip()]
+    metrics = RunMetrics()
+    st.session_state["run_metrics"] = metrics
+    classifier = PorotoclassifierLLM(providers=[("groq", k, model) for k in groq_keys], cache=cache,
+                                     pool_size=creds.get("workers", 4), metrics=metrics,
+                                     compact=creds.get("compact", False),
+                                     cascade=creds.get("model_speed") == "cascade",
+                                     stream=creds.get("stream", False),
+                                     examples=get_example_index(EXAMPLES_PATH.stat().st_mtime) if creds.get("examples") else None,
+                                     local_model=get_local_model(LOCAL_MODEL_PATH.stat().st_mtime) if creds.get("local") else None,
+                                     local_threshold=creds.get("threshold", DEFAULT_THRESHOLD))
     st.caption(f"Modelo: **{classifier.provider_name}**")
 
     jira = None
     jira_ok = False
     if creds.get("jira_email") and creds.get("jira_token"):
-        jira = JiraClient(creds["jira_url"], creds["jira_email"], creds["jira_token"])
+        jira = JiraClient(creds["jira_url"], creds["jira_email"], creds["jira_token"], metrics=metrics)
         try:
             test = jira.get_issue(porotos[0]["key"])
             if test:
@@ -186,9 +237,11 @@ def run_classification(porotos, creds):
                 st.success(f"Jira conectado OK - probado con {porotos[0]['key']}")
             else:
                 st.warning(f"Jira no encontró {porotos[0]['key']}. Verificá credenciales.")
+                jira.close()
                 jira = None
         except Exception as e:
             st.warning(f"Jira no disponible ({e}). Usando títulos del CSV.")
+            jira.close()
             jira = None
     else:
         has_titles = any(p.get("title") for p in porotos)
@@ -197,35 +250,43 @@ def run_classification(porotos, creds):
         else:
             st.error("Sin Jira y el CSV no tiene títulos. Agregá una columna con los títulos de los porotos.")
 
+    details = {}
+    jira_errors = 0
+    if jira:
+        with st.spinner(f"Leyendo {len(porotos)} tickets de Jira..."):
+            try:
+                details = jira.get_issues_details([p["key"] for p in porotos])
+            except Exception as e:
+                st.warning(f"Jira no disponible ({e}). Usando títulos del CSV.")
+
     results = []
     total = len(porotos)
-    jira_errors = 0
     progress_bar = st.progress(0, text=f"Clasificando 0/{total}...")
     status_text = st.empty()
     results_container = st.empty()
     start_time = time.time()
 
-    for i, poroto in enumerate(porotos):
+    tickets = []
+    for poroto in porotos:
         key = poroto["key"]
-        title = poroto.get("title", "")
-        description = ""
-        labels = []
-        components = []
-
+        ticket = {"key": key, "title": poroto.get("title", ""), "description": "",
+                  "labels": [], "components": []}
         if jira:
-            try:
-                details = jira.get_issue_details(key)
-                if details:
-                    title = details["title"]
-                    description = details["description"]
-                    labels = details["labels"]
-                    components = details["components"]
-                else:
-                    jira_errors += 1
-            except Exception:
+            d = details.get(key)
+            if d:
+                ticket = d
+            else:
                 jira_errors += 1
-
-        if not title:
+        tickets.append(ticket)
+
+    classified = classifier.iter_classify((t for t in tickets if t["title"]),
+                                          max_concurrency=creds.get("workers", 4),
+                                          batch_size=creds.get("batch_size", 1),
+                                          clusters=TitleClusters() if creds.get("cluster") else None,
+                                          baseline=baseline)
+    for i, ticket in enumerate(tickets):
+        key = ticket["key"]
+        if not ticket["title"]:
             row = {"key": key, "title": ""}
             for field in OUTPUT_FIELDS:
                 row[field] = ""
@@ -233,11 +294,11 @@ def run_classification(porotos, creds):
             row["JUSTIFICACION"] = "No se pudo obtener info del ticket (sin Jira ni titulo en CSV)"
             results.append(row)
         else:
-            result = classifier.classify(key, title, description, labels, components)
-            row = {"key": key, "title": title}
-            for field in OUTPUT_FIELDS:
+            _, result = next(classified)
+            row = {"key": key, "title": ticket["title"]}
+            for field in OUTPUT_FIELDS + META_FIELDS:
                 row[field] = result.get(field, "")
-            results.append(row)
+            results.append(row | ticket_fields(ticket))
 
         done = i + 1
         elapsed = time.time() - start_time
@@ -255,8 +316,25 @@ def run_classification(porotos, creds):
                 height=min(250, 35 * len(df_partial) + 38),
             )
 
+    classifier.close()
+    if jira:
+        jira.close()
+
     progress_bar.progress(1.0, text=f"✅ Listo: {total}/{total} clasificados en {elapsed:.0f}s")
     status_text.empty()
+    if classifier.stats["reglas"]:
+        st.caption(f"📏 {classifier.stats['reglas']} porotos resueltos por reglas del título, sin consultar al LLM")
+    if classifier.stats["reutilizados"]:
+        st.caption(f"🔁 {classifier.stats['reutilizados']} porotos sin cambios, copiados del resultado anterior")
+    if classifier.stats["agrupados"]:
+        st.caption(f"🧬 {classifier.stats['agrupados']} porotos copiados de un casi duplicado (columna CLUSTER)")
+    if classifier.stats["local"]:
+        st.caption(f"🧮 {classifier.stats['local']} porotos resueltos por el modelo local, sin consultar al LLM")
+    if classifier.escalation is not None:
+        st.caption(f"🪜 {classifier.stats['escalados']} porotos pasados al modelo preciso")
+    cache_hits = cache.hits - hits_before
+    if cache_hits:
+        st.caption(f"♻️ {cache_hits} porotos salieron del cache ({cache.misses - misses_before} consultados al LLM)")
     if jira_errors > 0:
         st.warning(f"⚠️ {jira_errors} tickets no se pudieron leer de Jira. Verificá las credenciales en el sidebar.")
     return results
@@ -299,6 +377,28 @@ def show_results(df):
         use_container_width=True,
     )
 
+    metrics = st.session_state.get("run_metrics")
+    if metrics is not None:
+        show_metrics(metrics.summary())
+
+
+def show_metrics(summary):
+    with st.expander("⏱️ Tiempos por etapa"):
+        stages = summary["etapas"]
+        if stages:
+            st.dataframe(
+                pd.DataFrame.from_dict(stages, orient="index").round(1),
+                use_container_width=True,
+            )
+        counters = summary["contadores"]
+        tokens = summary["tokens"]
+        c1, c2, c3, c4, c5 = st.columns(5)
+        c1.metric("Reintentos", counters.get("reintentos", 0))
+        c2.metric("Rate limits (429)", counters.get("429", 0))
+        c3.metric("Tokens enviados", tokens.get("in", 0))
+        c4.metric("Tokens desde cache", tokens.get("cache", 0))
+        c5.metric("Tokens recibidos", tokens.get("out", 0))
+
 
 # ──────────────────────────────────────────────
 # Main
@@ -317,6 +417,9 @@ def main():
         st.info("Esperando un archivo CSV con los porotos del quarter...")
         return
 
+    previous = st.file_uploader("Resultado anterior (opcional)", type=["csv"],
+                                help="CSV clasificado de una corrida anterior. Los porotos que no cambiaron en Jira se copian de ahí y solo se clasifica el resto.")
+
     porotos = parse_uploaded_csv(uploaded)
     if not porotos:
         st.error("No se encontraron IDs de porotos (SMPR-XXXXX) en el archivo.")
@@ -330,9 +433,10 @@ def main():
         classify_btn = st.button("🚀 Clasificar", type="primary", use_container_width=True)
     with col2:
         speed = creds.get("model_speed", "fast")
-        secs = 2 if speed == "fast" else 4
+        secs = 4 if speed == "accurate" else 2
         est_min = len(porotos) * secs / 60
-        st.caption(f"Tiempo estimado: ~{est_min:.0f} min ({secs}s/poroto en modo {'rápido' if speed == 'fast' else 'preciso'})")
+        mode = {"fast": "rápido", "accurate": "preciso", "cascade": "cascada"}.get(speed, "rápido")
+        st.caption(f"Tiempo estimado: ~{est_min:.0f} min ({secs}s/poroto en modo {mode})")
 
     if "results_df" in st.session_state and not classify_btn:
         show_results(st.session_state["results_df"])
@@ -341,11 +445,15 @@ def main():
     if not classify_btn:
         return
 
-    if not creds.get("groq_key"):
+    if not creds.get("groq_key") and not creds.get("local"):
         st.error("Configura la API key de Groq en el sidebar antes de clasificar.")
         return
 
-    results = run_classification(porotos, creds)
+    baseline = None
+    if previous is not None:
+        baseline = Baseline.from_file(io.StringIO(previous.getvalue().decode("utf-8-sig")))
+
+    results = run_classification(porotos, creds, baseline)
     if results:
         df = results_to_dataframe(results)
         st.session_state["results_df"] = df
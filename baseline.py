@@ -0,0 +1,66 @@
+"""Reuse of a previous quarter's results for tickets that haven't changed.
+
+Every output row records the ticket's Jira `updated` timestamp (ACTUALIZADO)
+and a hash of the content the classification is based on (HASH). Given the
+previous output CSV, a ticket whose timestamp or hash still matches gets its
+old row back with REUTILIZADO=si instead of being classified again.
+Rows from files written before these columns existed are never reused.
+"""
+
+import csv
+import hashlib
+import json
+
+from classifier import META_FIELDS, OUTPUT_FIELDS
+
+TICKET_FIELDS = ["ACTUALIZADO", "HASH"]
+
+
+def content_hash(ticket):
+    """Short hash of what the classifier reads from a ticket."""
+    content = [
+        ticket.get("title", ""),
+        ticket.get("description", ""),
+        sorted(ticket.get("labels") or []),
+        sorted(ticket.get("components") or []),
+    ]
+    return hashlib.sha256(json.dumps(content, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+def ticket_fields(ticket):
+    """ACTUALIZADO/HASH columns for a ticket's output row."""
+    return {"ACTUALIZADO": ticket.get("updated", ""), "HASH": content_hash(ticket)}
+
+
+class Baseline:
+    def __init__(self, rows):
+        """`rows` are output CSV records (dicts keyed by column name); ERROR rows are ignored."""
+        self.rows = {}
+        for rec in rows:
+            if rec.get("clave") and rec.get("ANTIGUEDAD") not in ("", "ERROR", None):
+                self.rows[rec["clave"]] = rec
+
+    def __len__(self):
+        return len(self.rows)
+
+    @classmethod
+    def from_file(cls, f):
+        """Read a previous output CSV from an open text file."""
+        return cls(csv.DictReader(f, delimiter=";"))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            return cls.from_file(f)
+
+    def reusable(self, ticket):
+        """The previous result for `ticket` if it hasn't changed since, else None."""
+        rec = self.rows.get(ticket["key"])
+        if rec is None:
+            return None
+        fields = ticket_fields(ticket)
+        same_update = bool(rec.get("ACTUALIZADO")) and rec["ACTUALIZADO"] == fields["ACTUALIZADO"]
+        same_content = bool(rec.get("HASH")) and rec["HASH"] == fields["HASH"]
+        if not (same_update or same_content):
+            return None
+        return {f: rec.get(f) or "" for f in OUTPUT_FIELDS + META_FIELDS} | fields | {"REUTILIZADO": "si"}
@@ -0,0 +1,128 @@
+"""Provider Batch API (OpenAI / Groq) for bulk runs that don't need interactive latency.
+
+Every ticket becomes one line of a JSONL file holding the same request body
+as an online classify. The file is uploaded to /v1/files, a batch is created
+on /v1/batches and polled until it finishes, and its output file is
+downloaded. Batch requests are billed at a discount and don't count against
+the online rate limits.
+
+The run's state (batch id plus, per ticket, what is needed to finish it) is
+a small JSON file next to the output CSV, so a process that dies while
+polling can pick the same batch up again.
+"""
+
+import json
+import os
+import time
+from pathlib import Path
+
+from http_session import build_session
+
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchClient:
+    def __init__(self, api_base, api_key, session=None):
+        self.api_base = api_base.rstrip("/")
+        self.headers = {"Authorization": f"Bearer {api_key}"}
+        self._owns_session = session is None
+        self.session = session or build_session()
+
+    @classmethod
+    def for_provider(cls, provider):
+        """A BatchClient on the same API and key as an LLMProvider (OpenAI-compatible only)."""
+        if provider.provider == "gemini":
+            raise ValueError("El modo batch solo está disponible para OpenAI y Groq.")
+        return cls(provider.base_url.rsplit("/chat/completions", 1)[0], provider.api_key)
+
+    def close(self):
+        if self._owns_session:
+            self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def upload(self, name, content):
+        """Upload a JSONL batch input. Returns the file id."""
+        resp = self.session.post(
+            f"{self.api_base}/files", headers=self.headers, data={"purpose": "batch"},
+            files={"file": (name, content.encode("utf-8"), "application/jsonl")}, timeout=300,
+        )
+        resp.raise_for_status()
+        return resp.json()["id"]
+
+    def create(self, input_file_id, completion_window="24h"):
+        resp = self.session.post(f"{self.api_base}/batches", headers=self.headers, json={
+            "input_file_id": input_file_id,
+            "endpoint": "/v1/chat/completions",
+            "completion_window": completion_window,
+        }, timeout=60)
+        resp.raise_for_status()
+        return resp.json()
+
+    def get(self, batch_id):
+        resp = self.session.get(f"{self.api_base}/batches/{batch_id}", headers=self.headers, timeout=60)
+        resp.raise_for_status()
+        return resp.json()
+
+    def download(self, file_id):
+        resp = self.session.get(f"{self.api_base}/files/{file_id}/content", headers=self.headers, timeout=300)
+        resp.raise_for_status()
+        return resp.content.decode("utf-8")
+
+    def wait(self, batch_id, poll_interval=30, on_status=None):
+        """Poll until the batch reaches a terminal status. Returns the batch object."""
+        while True:
+            batch = self.get(batch_id)
+            if on_status:
+                on_status(batch)
+            if batch.get("status") in TERMINAL_STATUSES:
+                return batch
+            time.sleep(poll_interval)
+
+
+def render_request(provider, custom_id, system_prompt, user_message, max_tokens):
+    """One line of the batch input file."""
+    return json.dumps({
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": provider.chat_payload(system_prompt, user_message, max_tokens),
+    }, ensure_ascii=False)
+
+
+def read_output(text):
+    """{custom_id: model answer} from a batch output file; failed requests map to None."""
+    answers = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        response = record.get("response") or {}
+        body = response.get("body") or {}
+        if response.get("status_code") == 200 and body.get("choices"):
+            answers[record["custom_id"]] = body["choices"][0]["message"]["content"]
+        else:
+            answers[record["custom_id"]] = None
+    return answers
+
+
+def load_state(path):
+    path = Path(path)
+    if not path.exists():
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(path, state):
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
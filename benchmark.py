@@ -0,0 +1,123 @@
+"""
+Benchmark offline del clasificador contra servidores locales (mock_servers.py).
+
+Corre el pipeline real de main.py (JiraClient + ProviderPool + LLMProvider)
+sobre CSVs sintéticos, sin gastar cuota de APIs.
+
+Uso:
+    python benchmark.py [--sizes 100 1000] [--workers 4] [--jira-workers 2]
+                        [--tickets-per-call 1] [--provider groq|openai|gemini]
+                        [--llm-latency 0.4] [--jira-latency 0.2]
+                        [--rate-429 0.0] [--malformed 0.0] [--stragglers 0.0]
+                        [--hedge P] [--stream] [--rpm 6000] [--tpm 2000000]
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from classifier import PorotoclassifierLLM
+from jira_client import JiraClient
+from main import ResultJournal, read_input_csv, run_pipeline
+from metrics import RunMetrics
+from mock_servers import MockConfig, MockServer
+
+
+def write_synthetic_csv(path, n):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("clave;link\n")
+        for i in range(1, n + 1):
+            f.write(f"SMPR-{i};https://mercadolibre.atlassian.net/browse/SMPR-{i}\n")
+
+
+def run_once(server, n, args, workdir):
+    input_path = workdir / f"porotos_{n}.csv"
+    write_synthetic_csv(input_path, n)
+    porotos = read_input_csv(input_path)
+
+    base_url = server.gemini_url if args.provider == "gemini" else server.openai_url
+    metrics = RunMetrics(workdir / f"metrics_{n}.jsonl")
+    classifier = PorotoclassifierLLM(providers=[(args.provider, "bench", None, base_url)],
+                                     pool_size=args.workers, metrics=metrics, compact=args.compact,
+                                     cascade=args.cascade, hedge_percentile=args.hedge / 100 if args.hedge else None,
+                                     stream=args.stream)
+    jira = JiraClient(server.url, "bench@example.com", "bench", pool_size=args.jira_workers, metrics=metrics)
+    journal = ResultJournal(workdir / f"resultado_{n}.csv")
+
+    server.stats.clear()
+    start = time.perf_counter()
+    try:
+        done = run_pipeline([p["key"] for p in porotos], classifier, jira, journal,
+                            workers=args.workers, jira_workers=args.jira_workers,
+                            batch_size=args.tickets_per_call, show_progress=False)
+    finally:
+        journal.close()
+        classifier.close()
+        jira.close()
+        metrics.close()
+    wall = time.perf_counter() - start
+
+    summary = metrics.summary()
+    counters = summary["contadores"]
+    llm = summary["etapas"].get("llm", {})
+    ticket = summary["etapas"].get("ticket", {})
+    return {
+        "porotos": n,
+        "wall_s": wall,
+        "porotos_s": done / wall if wall else 0,
+        "requests_llm": server.stats["llm"],
+        "429": server.stats["llm_429"],
+        "malformados": server.stats["llm_malformed"],
+        "reparados": counters.get("json_reparado", 0),
+        "reintentos": counters.get("reintentos", 0),
+        "errores": journal.counts.get("ERROR", 0),
+        "hedges": counters.get("hedge", 0),
+        "llm_p95_ms": llm.get("p95_ms", 0),
+        "ticket_p99_ms": ticket.get("p99_ms", 0),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline del clasificador de porotos")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000],
+                        help="cantidades de porotos sintéticos a correr (default: 100 1000)")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--jira-workers", type=int, default=2)
+    parser.add_argument("--tickets-per-call", type=int, default=1)
+    parser.add_argument("--compact", action="store_true", help="usar el formato de respuesta compacto")
+    parser.add_argument("--cascade", action="store_true", help="modelo rápido con escalado al preciso")
+    parser.add_argument("--stream", action="store_true", help="respuestas en streaming con corte temprano")
+    parser.add_argument("--provider", choices=["groq", "openai", "gemini"], default="groq")
+    parser.add_argument("--llm-latency", type=float, default=0.4, help="segundos por request al LLM")
+    parser.add_argument("--jira-latency", type=float, default=0.2, help="segundos por request a Jira")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="probabilidad de 429 por request")
+    parser.add_argument("--malformed", type=float, default=0.0, help="probabilidad de JSON roto por respuesta")
+    parser.add_argument("--stragglers", type=float, default=0.0,
+                        help="probabilidad de que una respuesta tarde 10s en vez de --llm-latency")
+    parser.add_argument("--hedge", type=float, metavar="P", help="hedging al percentil P de latencia (ej: 95)")
+    parser.add_argument("--rpm", type=int, default=6000, help="requests por minuto que anuncia el mock")
+    parser.add_argument("--tpm", type=int, default=2000000, help="tokens por minuto que anuncia el mock")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    config = MockConfig(
+        n_issues=max(args.sizes), jira_latency=args.jira_latency, llm_latency=args.llm_latency,
+        rate_429=args.rate_429, malformed=args.malformed, stragglers=args.stragglers,
+        rpm=args.rpm, tpm=args.tpm,
+    )
+    columns = ["porotos", "wall_s", "porotos_s", "requests_llm", "429", "malformados",
+               "reparados", "reintentos", "errores", "hedges", "llm_p95_ms", "ticket_p99_ms"]
+    print("  ".join(f"{c:>12}" for c in columns))
+    with MockServer(config) as server, tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            row = run_once(server, n, args, Path(tmp))
+            print("  ".join(
+                f"{row[c]:>12.2f}" if isinstance(row[c], float) else f"{row[c]:>12}" for c in columns
+            ))
+
+
+if __name__ == "__main__":
+    main()
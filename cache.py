@@ -0,0 +1,89 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+class ClassificationCache:
+    """SQLite cache of normalized classifications.
+
+    Entries are keyed by a hash of system prompt + model + user message, so a
+    change to any of them is a miss. Entries older than `max_age_days` expire
+    and only the `max_entries` most recently used are kept.
+    With `refresh=True` every lookup misses but new results are still stored.
+    """
+
+    def __init__(self, path, max_entries=20000, max_age_days=180, refresh=False):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 86400
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS clasificaciones ("
+            " clave TEXT PRIMARY KEY, resultado TEXT NOT NULL,"
+            " creado REAL NOT NULL, usado REAL NOT NULL)"
+        )
+        self.conn.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(system_prompt, model, user_message):
+        h = hashlib.sha256()
+        for part in (system_prompt, model, user_message):
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            row = None
+            if not self.refresh:
+                row = self.conn.execute(
+                    "SELECT resultado, creado FROM clasificaciones WHERE clave = ?", (key,)
+                ).fetchone()
+            now = time.time()
+            if row is None or now - row[1] > self.max_age:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE clasificaciones SET usado = ? WHERE clave = ?", (now, key))
+            self.conn.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put(self, key, result):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO clasificaciones (clave, resultado, creado, usado) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(result, ensure_ascii=False), now, now),
+            )
+            self.conn.commit()
+
+    def evict(self):
+        """Drop expired entries and trim to max_entries, least recently used first."""
+        with self.lock:
+            self.conn.execute("DELETE FROM clasificaciones WHERE creado < ?", (time.time() - self.max_age,))
+            self.conn.execute(
+                "DELETE FROM clasificaciones WHERE clave NOT IN"
+                " (SELECT clave FROM clasificaciones ORDER BY usado DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+            self.conn.commit()
+
+    @property
+    def stats(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0
+        return f"{self.hits} hits / {self.misses} misses ({rate:.0f}%)"
+
+    def close(self):
+        self.evict()
+        with self.lock:
+            self.conn.close()
@@ -1,9 +1,22 @@
+import difflib
 import json
+import re
+import threading
 import time
 import os
-import requests as http_requests
+import unicodedata
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 
-SYSTEM_PROMPT = """\
+from gemini_cache import GeminiContextCache, entry_gone
+from http_session import build_session
+from json_repair import JsonStream, parse_response
+from metrics import RunMetrics
+from rate_limiter import AdaptiveRateLimiter
+from rules import pre_classify
+from tokens import estimate_tokens, truncate_to_tokens
+
+PROMPT_CRITERIA = """\
 Sos un clasificador de "porotos" (tickets Jira trimestrales) para TMO \
 (Transaction Management & Operations) de Mercado Libre / Mercado Pago.
 
@@ -37,6 +50,10 @@ CLAVE: Si ves "[MLM, MLB, MLA]" o "in all sites" o "Point in all sites" → SIEM
 
 ### 6. JUSTIFICACION: 1 oración en español explicando.
 
+"""
+
+# Fixed examples; replaced by retrieved ones when an ExampleIndex is used.
+PROMPT_EXAMPLES = """\
 ## EJEMPLOS
 "[Carry Over] Banorte - Dictamen técnico" → Carry Over, campos 2-5 vacíos.
 "AMEX - Compensación comisiones" → N/A, campos 2-5 vacíos.
@@ -59,21 +76,124 @@ CLAVE: Si ves "[MLM, MLB, MLA]" o "in all sites" o "Point in all sites" → SIEM
 "BBVA Interredes - Tokenización (Card on file)" → Nuevo, Mejora, Soporte, solo un flujo.
 "[MLC] [A&D] - Promos Bancarias MLC ON/OFF" → Nuevo, Mejora, Analisis y Desarrollo, solo un flujo (A&D explícito en título).
 
+"""
+
+PROMPT_RULES = """\
 ## REGLAS ESTRICTAS
 - Carry Over/N/A → TIPO_DE_PRODUCTO, SCOPE, COMPLEJIDAD, SCOPE_REFINAMIENTO = "".
 - Nuevo → TIPO_DE_PRODUCTO, SCOPE, COMPLEJIDAD son OBLIGATORIOS, NUNCA vacíos.
   Si no estás seguro, usá los defaults: TIPO_DE_PRODUCTO="Mejora o modificacion de conexion existente", SCOPE="Desarrollo", COMPLEJIDAD="Poroto abarca solo un flujo".
 - SCOPE_REFINAMIENTO = SCOPE siempre.
 
+"""
+
+SYSTEM_PROMPT_BASE = PROMPT_CRITERIA + PROMPT_EXAMPLES + PROMPT_RULES
+
+# Without the fixed examples: the user message brings the most similar past porotos.
+RETRIEVAL_PROMPT_BASE = PROMPT_CRITERIA + PROMPT_RULES + """\
+Junto a cada ticket vas a recibir EJEMPLOS SIMILARES ya clasificados; usalos como referencia.
+
+"""
+
+# How the answer must be written; the criteria above are shared by every format.
+FULL_FORMAT = """\
 Respondé SOLO JSON válido (sin markdown):
 {"ANTIGUEDAD":"...","TIPO_DE_PRODUCTO":"...","SCOPE":"...","COMPLEJIDAD":"...","SCOPE_REFINAMIENTO":"...","JUSTIFICACION":"..."}
 """
 
+COMPACT_FORMAT = """\
+## FORMATO COMPACTO
+Respondé SOLO JSON válido (sin markdown) con códigos cortos, sin SCOPE_REFINAMIENTO:
+{"A":"N|C|X","T":"M|C|P","S":"D|S|A|AD","F":"1|2","J":"..."}
+- A (ANTIGUEDAD): N=Nuevo, C=Carry Over, X=N/A.
+- T (TIPO_DE_PRODUCTO): M=Mejora o modificacion de conexion existente, C=Nueva Conexion, P=Nuevo Producto.
+- S (SCOPE): D=Desarrollo, S=Soporte, A=Analisis, AD=Analisis y Desarrollo.
+- F (COMPLEJIDAD): 1=solo un flujo, 2=mas de un flujo.
+- Si A es C o X, omití T, S y F.
+- J (JUSTIFICACION): opcional, máximo 12 palabras.
+"""
+
+# Streaming formats: JUSTIFICACION/J goes right after ANTIGUEDAD/A, so a Carry Over/N/A
+# answer is settled (see _answer_settled) before fields 2-5 are written and the stream is cut there.
+FULL_STREAM_FORMAT = """\
+Respondé SOLO JSON válido (sin markdown), con los campos en este orden:
+{"ANTIGUEDAD":"...","JUSTIFICACION":"...","TIPO_DE_PRODUCTO":"...","SCOPE":"...","COMPLEJIDAD":"...","SCOPE_REFINAMIENTO":"..."}
+"""
+
+COMPACT_STREAM_FORMAT = """\
+## FORMATO COMPACTO
+Respondé SOLO JSON válido (sin markdown) con códigos cortos, sin SCOPE_REFINAMIENTO, con los campos en este orden:
+{"A":"N|C|X","J":"...","T":"M|C|P","S":"D|S|A|AD","F":"1|2"}
+- A (ANTIGUEDAD): N=Nuevo, C=Carry Over, X=N/A.
+- J (JUSTIFICACION): máximo 12 palabras, siempre justo después de A.
+- T (TIPO_DE_PRODUCTO): M=Mejora o modificacion de conexion existente, C=Nueva Conexion, P=Nuevo Producto.
+- S (SCOPE): D=Desarrollo, S=Soporte, A=Analisis, AD=Analisis y Desarrollo.
+- F (COMPLEJIDAD): 1=solo un flujo, 2=mas de un flujo.
+- Si A es C o X, omití T, S y F.
+"""
+
+SYSTEM_PROMPT = SYSTEM_PROMPT_BASE + FULL_FORMAT
+COMPACT_SYSTEM_PROMPT = SYSTEM_PROMPT_BASE + COMPACT_FORMAT
+
 OUTPUT_FIELDS = [
     "ANTIGUEDAD", "TIPO_DE_PRODUCTO", "SCOPE", "COMPLEJIDAD",
     "SCOPE_REFINAMIENTO", "JUSTIFICACION",
 ]
 
+# Columns describing how a row was produced, written after OUTPUT_FIELDS.
+META_FIELDS = ["MODELO", "NIVEL", "CLUSTER", "REUTILIZADO", "ACTUALIZADO", "HASH"]
+
+BATCH_INSTRUCTIONS = """
+## MODO LOTE
+Vas a recibir VARIOS tickets, cada uno después de una línea "=== Ticket N ===".
+Clasificá cada ticket por separado, con las mismas reglas.
+Respondé SOLO JSON válido (sin markdown), con un elemento por ticket en el mismo orden, \
+donde TICKET es la clave del ticket tal cual aparece (ej: SMPR-123):
+{"resultados":[{"TICKET":"...","ANTIGUEDAD":"...","TIPO_DE_PRODUCTO":"...","SCOPE":"...","COMPLEJIDAD":"...","SCOPE_REFINAMIENTO":"...","JUSTIFICACION":"..."}]}
+"""
+
+COMPACT_BATCH_INSTRUCTIONS = """
+## MODO LOTE
+Vas a recibir VARIOS tickets, cada uno después de una línea "=== Ticket N ===".
+Clasificá cada ticket por separado, con las mismas reglas y el mismo formato compacto.
+Respondé SOLO JSON válido (sin markdown), con un elemento por ticket en el mismo orden, \
+donde K es la clave del ticket tal cual aparece (ej: SMPR-123):
+{"resultados":[{"K":"...","A":"...","T":"...","S":"...","F":"...","J":"..."}]}
+"""
+
+BATCH_SYSTEM_PROMPT = SYSTEM_PROMPT + BATCH_INSTRUCTIONS
+COMPACT_BATCH_SYSTEM_PROMPT = COMPACT_SYSTEM_PROMPT + COMPACT_BATCH_INSTRUCTIONS
+
+# Compact answer code -> (field, code -> canonical value).
+COMPACT_CODES = {
+    "K": ("TICKET", {}),
+    "A": ("ANTIGUEDAD", {"N": "Nuevo", "C": "Carry Over", "X": "N/A"}),
+    "T": ("TIPO_DE_PRODUCTO", {
+        "M": "Mejora o modificacion de conexion existente",
+        "C": "Nueva Conexion",
+        "P": "Nuevo Producto",
+    }),
+    "S": ("SCOPE", {"D": "Desarrollo", "S": "Soporte", "A": "Analisis", "AD": "Analisis y Desarrollo"}),
+    "F": ("COMPLEJIDAD", {"1": "Poroto abarca solo un flujo", "2": "Poroto abarca mas de un flujo"}),
+    "J": ("JUSTIFICACION", {}),
+}
+
+
+def expand_compact(item):
+    """Turn a compact answer ({"A":"N","T":"M",...}) into OUTPUT_FIELDS names and values.
+
+    Answers already in the full format are returned unchanged; codes the model
+    spelled out go on to _normalize as they are.
+    """
+    if not isinstance(item, dict) or "ANTIGUEDAD" in item or "A" not in item:
+        return item
+    expanded = {}
+    for code, value in item.items():
+        field, values = COMPACT_CODES.get(code, (code, {}))
+        value = "" if value is None else str(value).strip()
+        expanded[field] = values.get(value.upper(), value)
+    return expanded
+
 _TIPO_PRODUCTO_NORM = {
     "mejora": "Mejora o modificacion de conexion existente",
     "mejora existente": "Mejora o modificacion de conexion existente",
@@ -103,9 +223,100 @@ _ANTIGUEDAD_NORM = {
 }
 
 
-def _normalize(result):
-    ant = result.get("ANTIGUEDAD", "")
-    result["ANTIGUEDAD"] = _ANTIGUEDAD_NORM.get(ant.lower().strip(), ant)
+_COMPLEJIDAD_NORM = {
+    "solo un flujo": "Poroto abarca solo un flujo",
+    "un flujo": "Poroto abarca solo un flujo",
+    "mas de un flujo": "Poroto abarca mas de un flujo",
+    "más de un flujo": "Poroto abarca mas de un flujo",
+}
+
+ANTIGUEDAD_VALUES = ["Nuevo", "Carry Over", "N/A"]
+
+
+def _fold(text):
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^\w/&]+", " ", text).split())
+
+
+def _norm_enum(value, table):
+    """Map a free-text enum value to its canonical form.
+
+    Exact lookups first, then accent/punctuation-insensitive ones, then the
+    closest spelling (difflib) among the table keys and canonical values.
+    Unknown values are returned unchanged.
+    """
+    value = str(value or "").strip()
+    if not value or value.lower() in table:
+        return table.get(value.lower(), value)
+    options = {_fold(k): v for k, v in table.items()}
+    options |= {_fold(v): v for v in table.values()}
+    folded = _fold(value)
+    if folded in options:
+        return options[folded]
+    match = difflib.get_close_matches(folded, list(options), n=1, cutoff=0.75)
+    return options[match[0]] if match else value
+
+
+_NORM_TABLES = {
+    "ANTIGUEDAD": _ANTIGUEDAD_NORM,
+    "TIPO_DE_PRODUCTO": _TIPO_PRODUCTO_NORM,
+    "SCOPE": _SCOPE_NORM,
+    "COMPLEJIDAD": _COMPLEJIDAD_NORM,
+}
+
+
+def _core_fields(answer):
+    return {f: _norm_enum(answer.get(f, ""), table) for f, table in _NORM_TABLES.items()}
+
+
+def _check_answer(answer):
+    """Raise ValueError unless the parsed answer has a usable ANTIGUEDAD."""
+    if not isinstance(answer, dict) or "ANTIGUEDAD" not in answer:
+        raise ValueError("Missing ANTIGUEDAD")
+    if _norm_enum(answer["ANTIGUEDAD"], _ANTIGUEDAD_NORM) not in ANTIGUEDAD_VALUES:
+        raise ValueError(f"ANTIGUEDAD inválida: {answer['ANTIGUEDAD']!r}")
+
+
+def _answer_settled(fields):
+    """Streaming early stop: Carry Over/N/A leave fields 2-5 empty, so ANTIGUEDAD and JUSTIFICACION are enough.
+
+    The streaming formats ask for JUSTIFICACION second, so this cuts the answer before fields 2-5.
+    """
+    antiguedad = fields.get("ANTIGUEDAD")
+    if antiguedad is None and "A" in fields:
+        antiguedad = COMPACT_CODES["A"][1].get(fields["A"].strip().upper(), fields["A"])
+    if antiguedad is None or _norm_enum(antiguedad, _ANTIGUEDAD_NORM) not in ("Carry Over", "N/A"):
+        return False
+    return "JUSTIFICACION" in fields or "J" in fields
+
+
+def _accept_answer(raw):
+    """ProviderPool `accept` check: the raw answer yields a usable classification."""
+    _check_answer(expand_compact(parse_response(raw)[0]))
+
+
+def _escalation_reason(answer, pinned, repaired):
+    """Why a fast-tier answer (parsed, not yet normalized) should go to the accurate tier, or None."""
+    if repaired:
+        return "reparado"
+    values = _core_fields(answer)
+    details = [f for f in _NORM_TABLES if f != "ANTIGUEDAD"]
+    if values["ANTIGUEDAD"] != "Nuevo":
+        # Carry Over / N/A leave fields 2-5 empty.
+        return "reglas" if any(values[f] for f in details) else None
+    if any(values[f] not in _NORM_TABLES[f].values() for f in details):
+        return "reglas"
+    refinement = str(answer.get("SCOPE_REFINAMIENTO") or "").strip()
+    if refinement and _norm_enum(refinement, _SCOPE_NORM) != values["SCOPE"]:
+        return "reglas"
+    if any(values[f] != value for f, value in (pinned or {}).items()):
+        return "titulo"
+    return None
+
+
+def _normalize(result, pinned=None):
+    result["ANTIGUEDAD"] = _norm_enum(result.get("ANTIGUEDAD", ""), _ANTIGUEDAD_NORM)
 
     if result["ANTIGUEDAD"] in ("Carry Over", "N/A"):
         result["TIPO_DE_PRODUCTO"] = ""
@@ -114,20 +325,20 @@ def _normalize(result):
         result["SCOPE_REFINAMIENTO"] = ""
         return result
 
-    tp = result.get("TIPO_DE_PRODUCTO", "")
-    result["TIPO_DE_PRODUCTO"] = _TIPO_PRODUCTO_NORM.get(tp.lower().strip(), tp)
+    result["TIPO_DE_PRODUCTO"] = _norm_enum(result.get("TIPO_DE_PRODUCTO", ""), _TIPO_PRODUCTO_NORM)
     if not result["TIPO_DE_PRODUCTO"]:
         result["TIPO_DE_PRODUCTO"] = "Mejora o modificacion de conexion existente"
 
-    sc = result.get("SCOPE", "")
-    result["SCOPE"] = _SCOPE_NORM.get(sc.lower().strip(), sc)
+    result["SCOPE"] = _norm_enum(result.get("SCOPE", ""), _SCOPE_NORM)
     if not result["SCOPE"]:
         result["SCOPE"] = "Desarrollo"
 
-    comp = result.get("COMPLEJIDAD", "")
-    if not comp:
+    result["COMPLEJIDAD"] = _norm_enum(result.get("COMPLEJIDAD", ""), _COMPLEJIDAD_NORM)
+    if not result["COMPLEJIDAD"]:
         result["COMPLEJIDAD"] = "Poroto abarca solo un flujo"
 
+    if pinned:
+        result.update(pinned)
     result["SCOPE_REFINAMIENTO"] = result["SCOPE"]
     return result
 
@@ -137,63 +348,215 @@ GROQ_MODELS = {
     "accurate": "llama-3.3-70b-versatile",
 }
 
+# Gemini 2.5 models think by default. Flash can turn it off; Pro needs at least 128 tokens.
+# Keyed by model prefix, so "gemini-2.5-flash" also covers flash-lite and previews.
+GEMINI_THINKING_BUDGETS = {"gemini-2.5-pro": 128, "gemini-2.5-flash": 0}
+
+
+def _gemini_thinking_budget(model):
+    """thinkingBudget to send for a Gemini model, or None for models that don't think."""
+    for prefix, budget in GEMINI_THINKING_BUDGETS.items():
+        if model.startswith(prefix):
+            return budget
+    return None
+
+
+# Second tier of the cascade, per provider.
+ACCURATE_MODELS = {
+    "groq": GROQ_MODELS["accurate"],
+    "gemini": "gemini-2.5-pro",
+    "openai": "gpt-4o",
+}
+
 
 class LLMProvider:
-    def __init__(self, provider, api_key, model=None):
+    def __init__(self, provider, api_key, model=None, base_url=None, session=None, pool_size=10, on_response=None,
+                 context_cache=None):
         self.provider = provider.lower()
         self.api_key = api_key
+        self.on_response = on_response
+        # GeminiContextCache for the system prompt (Gemini only).
+        self.context_cache = context_cache if self.provider == "gemini" else None
+        self._owns_session = session is None
+        self.session = session or build_session(pool_size)
         if self.provider == "groq":
             self.base_url = "https://api.groq.com/openai/v1/chat/completions"
             self.model = model or "llama-3.1-8b-instant"
             self.min_interval = 0.5
+            self.tokens_per_minute = 6000
         elif self.provider == "gemini":
             self.base_url = "https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
             self.model = model or "gemini-2.0-flash"
             self.min_interval = 4.2
+            self.tokens_per_minute = 1000000
         elif self.provider == "openai":
             self.base_url = "https://api.openai.com/v1/chat/completions"
             self.model = model or "gpt-4o-mini"
             self.min_interval = 0.5
+            self.tokens_per_minute = 200000
         else:
             raise ValueError(f"Provider '{provider}' no soportado.")
+        if base_url:
+            self.base_url = base_url
+
+    @property
+    def name(self):
+        return f"{self.provider}/{self.model}"
+
+    def close(self):
+        if self._owns_session:
+            self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
-    def call(self, system_prompt, user_message):
+    def call(self, system_prompt, user_message, max_tokens=300, temperature=0.1, stream=False, until=None,
+             cancel=None):
+        if stream:
+            return self._stream(system_prompt, user_message, max_tokens, temperature, until, cancel)
         if self.provider == "gemini":
-            return self._call_gemini(system_prompt, user_message)
-        return self._call_openai_compat(system_prompt, user_message)
+            return self._call_gemini(system_prompt, user_message, max_tokens, temperature)
+        return self._call_openai_compat(system_prompt, user_message, max_tokens, temperature)
 
-    def _call_openai_compat(self, system_prompt, user_message):
-        headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
-        payload = {
+    def chat_payload(self, system_prompt, user_message, max_tokens=300, temperature=0.1):
+        """Request body for OpenAI-compatible chat completions (also used for Batch API lines)."""
+        return {
             "model": self.model,
             "messages": [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_message},
             ],
-            "temperature": 0.1,
-            "max_tokens": 300,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
             "response_format": {"type": "json_object"},
         }
-        resp = http_requests.post(self.base_url, headers=headers, json=payload, timeout=30)
-        if resp.status_code == 429:
-            retry_after = resp.headers.get("retry-after")
-            wait = float(retry_after) if retry_after else 3.0
-            raise RateLimitError(wait)
-        resp.raise_for_status()
-        return resp.json()["choices"][0]["message"]["content"]
 
-    def _call_gemini(self, system_prompt, user_message):
-        url = self.base_url.format(model=self.model) + f"?key={self.api_key}"
-        payload = {
+    def _gemini_payload(self, system_prompt, user_message, max_tokens=300, temperature=0.1):
+        config = {
+            "temperature": temperature,
+            "maxOutputTokens": max_tokens,
+            "responseMimeType": "application/json",
+        }
+        thinking = _gemini_thinking_budget(self.model)
+        if thinking is not None:
+            # Thinking tokens count against maxOutputTokens; keep them small and on top of the answer's budget.
+            config["thinkingConfig"] = {"thinkingBudget": thinking}
+            config["maxOutputTokens"] = max_tokens + thinking
+        return {
             "system_instruction": {"parts": [{"text": system_prompt}]},
             "contents": [{"parts": [{"text": user_message}]}],
-            "generationConfig": {"temperature": 0.1, "responseMimeType": "application/json"},
+            "generationConfig": config,
         }
-        resp = http_requests.post(url, json=payload, timeout=30)
+
+    @staticmethod
+    def _gemini_usage(usage):
+        return {
+            "prompt_tokens": usage.get("promptTokenCount"),
+            "completion_tokens": usage.get("candidatesTokenCount"),
+            "total_tokens": usage.get("totalTokenCount"),
+            "cached_tokens": usage.get("cachedContentTokenCount"),
+        }
+
+    def _post_gemini(self, system_prompt, user_message, max_tokens=300, temperature=0.1, stream=False):
+        """POST to (stream)generateContent, referencing the cached system prompt when there is one."""
+        url = self.base_url.format(model=self.model)
+        if stream:
+            url = url.replace(":generateContent", ":streamGenerateContent") + f"?alt=sse&key={self.api_key}"
+        else:
+            url += f"?key={self.api_key}"
+        payload = self._gemini_payload(system_prompt, user_message, max_tokens, temperature)
+        cached = self.context_cache.get(self, system_prompt) if self.context_cache else None
+        if cached:
+            cached_payload = {k: v for k, v in payload.items() if k != "system_instruction"}
+            resp = self.session.post(url, json=cached_payload | {"cachedContent": cached}, timeout=30, stream=stream)
+            if resp.ok or not entry_gone(resp):
+                return resp
+            # The entry expired or was deleted: drop it and send the prompt inline.
+            resp.close()
+            self.context_cache.invalidate(self, system_prompt)
+        return self.session.post(url, json=payload, timeout=30, stream=stream)
+
+    def _rate_limit_error(self, resp):
+        if self.provider == "gemini":
+            return RateLimitError(5.0)
+        if self.on_response:
+            self.on_response(resp.headers, None)
+        retry_after = resp.headers.get("retry-after")
+        return RateLimitError(float(retry_after) if retry_after else 3.0)
+
+    def _call_openai_compat(self, system_prompt, user_message, max_tokens=300, temperature=0.1):
+        headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+        payload = self.chat_payload(system_prompt, user_message, max_tokens, temperature)
+        resp = self.session.post(self.base_url, headers=headers, json=payload, timeout=30)
         if resp.status_code == 429:
-            raise RateLimitError(5.0)
+            raise self._rate_limit_error(resp)
         resp.raise_for_status()
-        return resp.json()["candidates"][0]["content"]["parts"][0]["text"]
+        data = resp.json()
+        if self.on_response:
+            self.on_response(resp.headers, data.get("usage"))
+        return data["choices"][0]["message"]["content"]
+
+    def _call_gemini(self, system_prompt, user_message, max_tokens=300, temperature=0.1):
+        resp = self._post_gemini(system_prompt, user_message, max_tokens, temperature)
+        if resp.status_code == 429:
+            raise self._rate_limit_error(resp)
+        resp.raise_for_status()
+        data = resp.json()
+        if self.on_response:
+            self.on_response(resp.headers, self._gemini_usage(data.get("usageMetadata", {})))
+        return data["candidates"][0]["content"]["parts"][0]["text"]
+
+    def _stream(self, system_prompt, user_message, max_tokens=300, temperature=0.1, until=None, cancel=None):
+        """Streamed call (SSE). The answer is parsed as it arrives; once the JSON object is
+        complete the rest of the stream is only read for its usage event. The stream is cut
+        early once until(fields) says the rest of the answer isn't needed; then the fields
+        received so far are returned as JSON. Once the `cancel` Event is set the response
+        is closed at the next chunk and None is returned."""
+        if self.provider == "gemini":
+            resp = self._post_gemini(system_prompt, user_message, max_tokens, temperature, stream=True)
+        else:
+            headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+            payload = self.chat_payload(system_prompt, user_message, max_tokens, temperature)
+            payload |= {"stream": True, "stream_options": {"include_usage": True}}
+            resp = self.session.post(self.base_url, headers=headers, json=payload, timeout=30, stream=True)
+
+        with resp:
+            if resp.status_code == 429:
+                raise self._rate_limit_error(resp)
+            resp.raise_for_status()
+            answer, usage, early = JsonStream(), None, False
+            for line in resp.iter_lines():
+                if cancel is not None and cancel.is_set():
+                    return None
+                line = line.decode("utf-8")
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                event = json.loads(data)
+                if self.provider == "gemini":
+                    parts = (event.get("candidates") or [{}])[0].get("content", {}).get("parts") or [{}]
+                    text = parts[0].get("text", "")
+                    usage = self._gemini_usage(event["usageMetadata"]) if "usageMetadata" in event else usage
+                else:
+                    choices = event.get("choices") or [{}]
+                    text = (choices[0].get("delta") or {}).get("content") or ""
+                    usage = event.get("usage") or usage
+                if not text or answer.complete:
+                    continue
+                fields = answer.feed(text)
+                if answer.complete:
+                    continue
+                if until and until(fields):
+                    early = True
+                    break
+        if self.on_response:
+            self.on_response(resp.headers, usage)
+        return json.dumps(answer.fields, ensure_ascii=False) if early else answer.text
 
 
 class RateLimitError(Exception):
@@ -202,81 +565,747 @@ class RateLimitError(Exception):
         super().__init__(f"Rate limited, wait {wait_seconds}s")
 
 
+class AnswerRejected(ValueError):
+    """The provider answered, but the caller's `accept` check refused the answer."""
+
+
+class ProviderPool:
+    """Several LLMProviders (different providers or API keys) behind one `call`.
+
+    Each member has its own AdaptiveRateLimiter, starting at 1/min_interval and
+    the provider's default TPM and fed with the member's rate-limit headers.
+    A call is admitted only when both a request slot and its estimated tokens
+    (system prompt + message + max_tokens) fit, and goes to the member that
+    can send it soonest; a member that answers 429 or fails is paused and the
+    call fails over to the next one. RateLimitError is raised only when every
+    member is throttled.
+
+    With hedge_percentile (e.g. 0.95), a call still unanswered after that
+    percentile of recent latencies is duplicated on the member that can send
+    soonest, and the first valid answer wins. Each completed request earns
+    hedge_budget of a hedge, so hedges stay under that fraction of requests
+    and still go through the limiters. Hedges run on a thread pool sized for
+    `pool_size` concurrent calls (a primary and a hedge each).
+    """
+
+    HEDGE_MIN_SAMPLES = 20
+    HEDGE_CREDIT_MAX = 5
+
+    def __init__(self, members, metrics=None, hedge_percentile=None, hedge_budget=0.1, pool_size=10):
+        self.members = list(members)
+        self.metrics = metrics or RunMetrics()
+        self.limiters = [AdaptiveRateLimiter(1 / m.min_interval, m.tokens_per_minute) for m in self.members]
+        self.stats = [Counter() for _ in self.members]
+        for i, member in enumerate(self.members):
+            member.on_response = lambda headers, usage, i=i: self._on_response(i, headers, usage)
+        self._streaks = [0] * len(self.members)
+        self._lock = threading.Lock()
+        self.hedge_percentile = hedge_percentile
+        self.hedge_budget = hedge_budget
+        self.hedge_stats = Counter()
+        self._hedge_credit = 0.0
+        self._latencies = deque(maxlen=200)
+        self._executor = ThreadPoolExecutor(max_workers=2 * pool_size, thread_name_prefix="llm-hedge") if hedge_percentile else None
+        names = [m.name for m in self.members]
+        self.labels = [
+            f"{n} #{names[:i].count(n) + 1}" if names.count(n) > 1 else n
+            for i, n in enumerate(names)
+        ]
+
+    @property
+    def model(self):
+        """Identity of the pool for cache keys: the distinct models it answers with."""
+        return "+".join(sorted({m.model for m in self.members}))
+
+    @property
+    def name(self):
+        return ", ".join(self.labels)
+
+    def _on_response(self, i, headers, usage):
+        self.limiters[i].observe(headers, usage)
+        if usage:
+            # Gemini: cachedContentTokenCount (see _gemini_usage); OpenAI: prompt_tokens_details.cached_tokens.
+            cached = usage.get("cached_tokens") or (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+            self.metrics.usage(usage.get("prompt_tokens"), usage.get("completion_tokens"), self.labels[i], cached)
+            with self._lock:
+                self.stats[i]["tokens_in"] += usage.get("prompt_tokens") or 0
+                self.stats[i]["tokens_out"] += usage.get("completion_tokens") or 0
+                self.stats[i]["tokens_cache"] += cached or 0
+
+    def _pick(self, tried, cost):
+        candidates = [i for i in range(len(self.members)) if i not in tried]
+        return min(candidates, key=lambda i: (self.limiters[i].delay(cost), i))
+
+    def _send(self, i, cost, system_prompt, user_message, max_tokens, temperature, stream=False, until=None,
+              key=None, sent=None, cancel=None):
+        """One request to member i, through its limiter; failures update its backoff and re-raise.
+
+        `sent` is set once the limiter lets the request go. With `cancel` set the
+        request is dropped (None) if it hasn't gone out yet, and a stream is closed.
+        """
+        member, limiter, stats = self.members[i], self.limiters[i], self.stats[i]
+        with self.metrics.bind(key or self.metrics.current_key):
+            try:
+                self.metrics.record("rate_limit", limiter.acquire(cost), provider=self.labels[i])
+            finally:
+                if sent is not None:
+                    sent.set()
+            if cancel is not None and cancel.is_set():
+                return None
+            start = time.perf_counter()
+            first_field = []
+
+            def watch(fields):
+                if fields and not first_field:
+                    first_field.append(True)
+                    self.metrics.record("primer_campo", time.perf_counter() - start, provider=self.labels[i])
+                return until(fields) if until else False
+
+            try:
+                with self.metrics.span("llm", provider=self.labels[i]):
+                    text = member.call(system_prompt, user_message, max_tokens=max_tokens, temperature=temperature,
+                                       stream=stream, until=watch if stream else None, cancel=cancel)
+            except RateLimitError as e:
+                self.metrics.count("429")
+                with self._lock:
+                    stats["429"] += 1
+                    self._streaks[i] += 1
+                    streak = self._streaks[i]
+                limiter.on_throttle(min(e.wait_seconds + 2 * (streak - 1), 20))
+                raise
+            except Exception:
+                self.metrics.count("errores_llm")
+                with self._lock:
+                    stats["errores"] += 1
+                    self._streaks[i] += 1
+                    streak = self._streaks[i]
+                if streak >= 2:
+                    limiter.pause(min(2 ** streak, 60))
+                raise
+        limiter.on_success()
+        with self._lock:
+            stats["requests"] += 1
+            self._streaks[i] = 0
+            if text is not None:
+                self._latencies.append(time.perf_counter() - start)
+            self._hedge_credit = min(self._hedge_credit + self.hedge_budget, self.HEDGE_CREDIT_MAX)
+        return text
+
+    def _hedge_delay(self):
+        """How long to wait before hedging: the hedge_percentile of recent latencies (None = don't hedge)."""
+        if self.hedge_percentile is None:
+            return None
+        with self._lock:
+            if len(self._latencies) < self.HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile))]
+
+    def _take_hedge(self):
+        with self._lock:
+            if self._hedge_credit < 1:
+                return False
+            self._hedge_credit -= 1
+            return True
+
+    @staticmethod
+    def _checked(text, accept):
+        if accept:
+            try:
+                accept(text)
+            except ValueError as e:
+                raise AnswerRejected(str(e)) from e
+        return text
+
+    def _hedged(self, i, cost, args, accept):
+        """Send to member i; if it is slower than _hedge_delay, race a duplicate on the member
+        that can send soonest. Returns (text, index of the member that won).
+
+        The delay counts from when the primary leaves its limiter, and a hedge is only
+        sent to a member with a free slot right now, so waiting for the rate limit is
+        never hedged. The losing stream is closed.
+        """
+        delay = self._hedge_delay()
+        if delay is None:
+            return self._checked(self._send(i, cost, *args), accept), i
+
+        key = self.metrics.current_key
+        sent, cancel = threading.Event(), threading.Event()
+        primary = self._executor.submit(self._send, i, cost, *args, key, sent, cancel)
+        sent.wait()
+        if wait([primary], timeout=delay).done:
+            return self._checked(primary.result(), accept), i
+        j = self._pick(set(), cost)
+        if self.limiters[j].delay(cost) > 0 or not self._take_hedge():
+            return self._checked(primary.result(), accept), i
+        hedge = self._executor.submit(self._send, j, cost, *args, key, None, cancel)
+        self.metrics.count("hedge")
+        with self._lock:
+            self.hedge_stats["hedges"] += 1
+        futures = {primary: i, hedge: j}
+        errors = []
+        for future in as_completed(futures):
+            try:
+                text = self._checked(future.result(), accept)
+            except Exception as e:
+                errors.append(e)
+                continue
+            # A streamed loser closes its response at the next chunk; a plain one runs to the end.
+            cancel.set()
+            if future is hedge:
+                self.metrics.count("hedge_ganado")
+                with self._lock:
+                    self.hedge_stats["hedges_ganados"] += 1
+            return text, futures[future]
+        # A refused answer means the provider works: report that rather than fail over.
+        raise next((e for e in errors if isinstance(e, AnswerRejected)), errors[-1])
+
+    def call(self, system_prompt, user_message, max_tokens=300, temperature=0.1, accept=None, stream=False,
+             until=None):
+        """Returns (text, name of the provider/model that answered).
+
+        `accept(text)` may raise ValueError to reject an answer: with hedging,
+        the other in-flight request then gets the chance to win. A rejected
+        answer is raised as AnswerRejected without failing over, since the
+        provider itself answered. With `stream`, answers are streamed (see
+        LLMProvider._stream), `until` can end them early, and the time to the
+        first complete field is recorded as "primer_campo".
+        """
+        cost = estimate_tokens(system_prompt) + estimate_tokens(user_message) + max_tokens
+        args = (system_prompt, user_message, max_tokens, temperature, stream, until)
+        tried = set()
+        last_error = None
+        while len(tried) < len(self.members):
+            i = self._pick(tried, cost)
+            tried.add(i)
+            try:
+                text, i = self._hedged(i, cost, args, accept)
+            except AnswerRejected:
+                raise
+            except Exception as e:
+                last_error = e
+                continue
+            return text, self.members[i].name
+        raise last_error
+
+    def summary(self):
+        """(label, counters) per member; counters include the limiter's current req/s."""
+        return [
+            (label, dict(stats) | {"req_s": limiter.current_rate})
+            for label, stats, limiter in zip(self.labels, self.stats, self.limiters)
+        ]
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        for member in self.members:
+            member.close()
+
+
+def _detect_providers():
+    """Every configured (provider, api_key). GROQ_API_KEY may hold several comma-separated keys."""
+    found = []
+    for provider, var in (("groq", "GROQ_API_KEY"), ("gemini", "GEMINI_API_KEY"), ("openai", "OPENAI_API_KEY")):
+        for key in (os.getenv(var) or "").split(","):
+            if key.strip():
+                found.append((provider, key.strip()))
+    return found
+
+
 def _detect_provider():
-    groq_key = os.getenv("GROQ_API_KEY")
-    gemini_key = os.getenv("GEMINI_API_KEY")
-    openai_key = os.getenv("OPENAI_API_KEY")
-    if groq_key:
-        return "groq", groq_key
-    if gemini_key:
-        return "gemini", gemini_key
-    if openai_key:
-        return "openai", openai_key
-    return None, None
+    found = _detect_providers()
+    return found[0] if found else (None, None)
+
+
+def _error_result(message):
+    return {f: "" for f in OUTPUT_FIELDS} | {"ANTIGUEDAD": "ERROR", "JUSTIFICACION": message}
+
+
+DESCRIPTION_TOKENS = 500
+
+
+def build_user_message(ticket_key, title, description="", labels=None, components=None):
+    user_msg = f"Ticket: {ticket_key}\nTítulo: {title}\n"
+    if description:
+        user_msg += f"\nDescripción:\n{truncate_to_tokens(description, DESCRIPTION_TOKENS)}\n"
+    if labels:
+        user_msg += f"\nLabels: {', '.join(labels)}\n"
+    if components:
+        user_msg += f"\nComponents: {', '.join(components)}\n"
+    return user_msg
 
 
 class PorotoclassifierLLM:
-    def __init__(self, provider=None, api_key=None, model=None):
-        if provider is None or api_key is None:
-            provider, api_key = _detect_provider()
-        if not provider or not api_key:
+    BATCH_INPUT_TOKENS = 6000
+    BATCH_OUTPUT_TOKENS_PER_TICKET = 150
+    MAX_TOKENS = 300
+    COMPACT_MAX_TOKENS = 80
+    COMPACT_OUTPUT_TOKENS_PER_TICKET = 50
+    SAMPLE_TEMPERATURE = 0.7
+
+    def __init__(self, provider=None, api_key=None, model=None, cache=None, pool_size=10, providers=None,
+                 metrics=None, compact=False, cascade=False, escalation_providers=None, samples=1,
+                 hedge_percentile=None, hedge_budget=0.1, stream=False, context_cache=None,
+                 examples=None, k=5, local_model=None, local_threshold=0.9):
+        """`providers` is a list of (provider, api_key[, model[, base_url]]) to
+        balance across. Without it, `provider`/`api_key` give a single member,
+        and with neither every key found in the environment is used.
+        With `compact`, the model answers with short codes (COMPACT_FORMAT) that
+        are expanded locally, which needs far fewer output tokens.
+
+        With `cascade` (or explicit `escalation_providers`), `providers` are the
+        fast tier and a ticket is re-asked to the accurate tier (ACCURATE_MODELS
+        on the same keys by default) only when the fast answer needed JSON
+        repair, breaks the prompt's rules, contradicts the title tags, or, with
+        samples > 1, changes between samples. NIVEL records the tier.
+        `hedge_percentile`/`hedge_budget` turn on hedged requests (see ProviderPool).
+        With `stream`, single-ticket answers are streamed and cut short once a
+        Carry Over/N/A answer has its JUSTIFICACION.
+        `context_cache` (a GeminiContextCache) keeps the system prompt in Gemini's
+        cachedContents; by default one is created for the run.
+        With `examples` (an ExampleIndex), the fixed EJEMPLOS of the prompt are
+        replaced by the `k` most similar past porotos, sent in each ticket's
+        user message so the system prompt stays the same for every request.
+        With `local_model` (a LocalModel), tickets it predicts with at least
+        `local_threshold` confidence are answered without the LLM; with no API
+        key at all, it answers every ticket."""
+        if providers is None:
+            if provider and api_key:
+                providers = [(provider, api_key, model)]
+            else:
+                providers = [(p, k, model if p == provider else None) for p, k in _detect_providers()]
+        if not providers and local_model is None:
             raise RuntimeError(
                 "No se encontro API key de LLM. Configura al menos una:\n"
                 "  GROQ_API_KEY (gratis en https://console.groq.com/keys)"
             )
-        self.llm = LLMProvider(provider, api_key, model)
-        self.last_request_time = 0
+        self.metrics = metrics or RunMetrics()
+        hedging = {"hedge_percentile": hedge_percentile, "hedge_budget": hedge_budget}
+        self.context_cache = context_cache or GeminiContextCache()
+        self.llm = None
+        if providers:
+            self.llm = ProviderPool(
+                (LLMProvider(*member, pool_size=pool_size, context_cache=self.context_cache) for member in providers),
+                metrics=self.metrics, pool_size=pool_size, **hedging,
+            )
+        self.escalation = None
+        if cascade and escalation_providers is None:
+            escalation_providers = [(m[0], m[1], ACCURATE_MODELS[m[0].lower()], *m[3:]) for m in providers]
+        if escalation_providers:
+            self.escalation = ProviderPool(
+                (LLMProvider(*member, pool_size=pool_size, context_cache=self.context_cache)
+                 for member in escalation_providers),
+                metrics=self.metrics, pool_size=pool_size, **hedging,
+            )
+        self.samples = samples
+        self.stream = stream
+        self.compact = compact
+        if compact:
+            self.system_prompt, self.batch_system_prompt = COMPACT_SYSTEM_PROMPT, COMPACT_BATCH_SYSTEM_PROMPT
+            self.max_tokens, self.batch_tokens_per_ticket = self.COMPACT_MAX_TOKENS, self.COMPACT_OUTPUT_TOKENS_PER_TICKET
+        else:
+            self.system_prompt, self.batch_system_prompt = SYSTEM_PROMPT, BATCH_SYSTEM_PROMPT
+            self.max_tokens, self.batch_tokens_per_ticket = self.MAX_TOKENS, self.BATCH_OUTPUT_TOKENS_PER_TICKET
+        self.examples = examples
+        self.k = k
+        self.local_model = local_model
+        self.local_threshold = local_threshold
+        if examples is not None:
+            self.system_prompt = RETRIEVAL_PROMPT_BASE + (COMPACT_FORMAT if compact else FULL_FORMAT)
+            self.batch_system_prompt = self.system_prompt + (
+                COMPACT_BATCH_INSTRUCTIONS if compact else BATCH_INSTRUCTIONS)
+        if stream:
+            # Only single-ticket requests are streamed; batches keep the usual field order.
+            base = RETRIEVAL_PROMPT_BASE if examples is not None else SYSTEM_PROMPT_BASE
+            self.system_prompt = base + (COMPACT_STREAM_FORMAT if compact else FULL_STREAM_FORMAT)
+        self.cache = cache
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
 
     @property
     def provider_name(self):
-        return f"{self.llm.provider} / {self.llm.model}"
+        if self.llm is None:
+            return "local"
+        if self.escalation is not None:
+            return f"{self.llm.name} -> {self.escalation.name}"
+        return self.llm.name
 
-    def _rate_limit(self):
-        elapsed = time.time() - self.last_request_time
-        if elapsed < self.llm.min_interval:
-            time.sleep(self.llm.min_interval - elapsed)
-        self.last_request_time = time.time()
+    @property
+    def model_id(self):
+        """The models behind the answers, for cache keys."""
+        if self.llm is None:
+            return "local"
+        if self.escalation is not None:
+            return f"{self.llm.model}>{self.escalation.model}"
+        return self.llm.model
+
+    @property
+    def pools(self):
+        return [pool for pool in (self.llm, self.escalation) if pool is not None]
+
+    def close(self):
+        for pool in self.pools:
+            pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            self.stats[name] += n
+
+    def _prepare(self, ticket_key, title, description, labels, components):
+        """Run the title rules, the cache lookup and the local model, in that order.
+
+        Returns (result, pinned, user_msg, cache_key); `result` is set when the
+        ticket needs no LLM call.
+        """
+        ruled, pinned = pre_classify(title)
+        if ruled is not None:
+            self._count("reglas")
+            return _normalize({f: "" for f in OUTPUT_FIELDS} | ruled | {"MODELO": "reglas"}), pinned, None, None
+        if pinned:
+            self._count("reglas_parciales")
+
+        user_msg = build_user_message(ticket_key, title, description, labels, components)
+        if self.examples is not None:
+            with self.metrics.span("ejemplos"):
+                user_msg = self.examples.render(title, self.k, exclude_key=ticket_key) + user_msg
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(self.system_prompt, self.model_id, user_msg)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached, pinned, user_msg, cache_key
+
+        if self.local_model is not None:
+            with self.metrics.span("local"):
+                predicted, confidence = self.local_model.predict(title)
+            if confidence >= self.local_threshold or self.llm is None:
+                self._count("local")
+                justification = f"Modelo local (confianza {confidence:.0%})."
+                return _normalize({f: "" for f in OUTPUT_FIELDS} | predicted | {
+                    "JUSTIFICACION": justification, "MODELO": "local",
+                }, pinned), pinned, None, None
+        return None, pinned, user_msg, cache_key
+
+    def prepare(self, ticket):
+        """Rules and cache for one ticket dict; see _prepare."""
+        return self._prepare(
+            ticket["key"], ticket.get("title", ""), ticket.get("description", ""),
+            ticket.get("labels"), ticket.get("components"),
+        )
+
+    def finish_answer(self, raw, pinned, cache_key, source):
+        """Turn a model answer obtained elsewhere (e.g. a Batch API output line) into a result."""
+        if raw is None:
+            return _error_result("Error: el proveedor no devolvió respuesta")
+        try:
+            data, repaired = parse_response(raw)
+            data = expand_compact(data)
+            _check_answer(data)
+        except ValueError as e:
+            return _error_result(f"Error: {e}")
+        if repaired:
+            self._repaired()
+        return self._finish(data, pinned, cache_key, source)
+
+    def _finish(self, result, pinned, cache_key, source, tier=""):
+        result = expand_compact(result)
+        if not isinstance(result, dict) or "ANTIGUEDAD" not in result:
+            raise ValueError("Missing ANTIGUEDAD")
+
+        for field in OUTPUT_FIELDS:
+            result.setdefault(field, "")
+
+        result = _normalize(result, pinned)
+        if result["ANTIGUEDAD"] not in ANTIGUEDAD_VALUES:
+            raise ValueError(f"ANTIGUEDAD inválida: {result['ANTIGUEDAD']!r}")
+        result["MODELO"] = source
+        result["NIVEL"] = tier
+        if cache_key is not None:
+            self.cache.put(cache_key, result)
+        return result
+
+    def _repaired(self, n=1):
+        self._count("json_reparados", n)
+        self.metrics.count("json_reparado", n)
 
     def classify(self, ticket_key, title, description="", labels=None, components=None, max_retries=5):
-        user_msg = f"Ticket: {ticket_key}\nTítulo: {title}\n"
-        if description:
-            user_msg += f"\nDescripción:\n{description[:2000]}\n"
-        if labels:
-            user_msg += f"\nLabels: {', '.join(labels)}\n"
-        if components:
-            user_msg += f"\nComponents: {', '.join(components)}\n"
+        with self.metrics.bind(ticket_key), self.metrics.span("ticket"):
+            result, pinned, user_msg, cache_key = self._prepare(ticket_key, title, description, labels, components)
+            if result is not None:
+                return result
+            return self._classify_llm(user_msg, pinned, cache_key, max_retries)
 
+    def _ask(self, pool, user_msg, max_retries=5, temperature=0.1):
+        """One usable answer from `pool` for a single ticket.
+
+        Rate limits and unusable output are retried right away, other errors
+        after 2s. Returns (answer as parsed, whether it needed repair, source);
+        raises the last error when the retries run out.
+        """
         for attempt in range(max_retries):
+            if attempt:
+                self.metrics.count("reintentos")
             try:
-                self._rate_limit()
-                raw = self.llm.call(SYSTEM_PROMPT, user_msg)
-                text = raw.strip()
-                if text.startswith("```"):
-                    text = text.split("\n", 1)[-1].rsplit("```", 1)[0].strip()
+                raw, source = pool.call(self.system_prompt, user_msg, max_tokens=self.max_tokens,
+                                        temperature=temperature, accept=_accept_answer,
+                                        stream=self.stream, until=_answer_settled)
+                with self.metrics.span("parse"):
+                    data, repaired = parse_response(raw)
+                    data = expand_compact(data)
+                    _check_answer(data)
+                if repaired:
+                    self._repaired()
+                return data, repaired, source
+            except (RateLimitError, ValueError):
+                if attempt == max_retries - 1:
+                    raise
+            except Exception:
+                if attempt == max_retries - 1:
+                    raise
+                time.sleep(2)
 
-                result = json.loads(text)
-                if "ANTIGUEDAD" not in result:
-                    raise ValueError("Missing ANTIGUEDAD")
+    def _classify_llm(self, user_msg, pinned, cache_key, max_retries=5):
+        try:
+            answer, repaired, source = self._ask(self.llm, user_msg, max_retries)
+        except RateLimitError:
+            return _error_result("Error: rate limit agotado tras reintentos")
+        except Exception as e:
+            return _error_result(f"Error: {e}")
+        answer, source, tier = self._escalate(answer, repaired, source, pinned, user_msg, max_retries)
+        return self._finish(answer, pinned, cache_key, source, tier)
 
-                for field in OUTPUT_FIELDS:
-                    result.setdefault(field, "")
+    def _escalation_reason(self, answer, pinned, repaired, user_msg):
+        reason = _escalation_reason(answer, pinned, repaired)
+        if reason is None and self.samples > 1:
+            first = _core_fields(answer)
+            for _ in range(self.samples - 1):
+                try:
+                    other, _, _ = self._ask(self.llm, user_msg, max_retries=1, temperature=self.SAMPLE_TEMPERATURE)
+                except Exception:
+                    continue
+                if _core_fields(other) != first:
+                    return "muestreo"
+        return reason
 
-                result = _normalize(result)
-                return result
+    def _escalate(self, answer, repaired, source, pinned, user_msg, max_retries=5):
+        """Cascade step: hand the ticket to the accurate tier when the fast answer looks unreliable.
 
-            except RateLimitError as e:
-                wait = min(e.wait_seconds + (attempt * 2), 20)
-                time.sleep(wait)
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    time.sleep(2)
+        Returns (answer, source, tier); tier is "" outside cascade mode.
+        """
+        if self.escalation is None:
+            return answer, source, ""
+        reason = self._escalation_reason(answer, pinned, repaired, user_msg)
+        if reason is None:
+            return answer, source, "rapido"
+        self._count("escalados")
+        self._count(f"escalados_{reason}")
+        self.metrics.count("escalados")
+        try:
+            accurate, _, accurate_source = self._ask(self.escalation, user_msg, max_retries)
+        except Exception:
+            self._count("escalados_fallidos")
+            return answer, source, "rapido"
+        return accurate, accurate_source, "preciso"
+
+    def _request_batch(self, user_msgs, max_retries=5):
+        """Send several tickets in one request.
+
+        Returns (parsed result list, provider/model that answered, whether the
+        JSON needed repair); the list is empty on failure.
+        """
+        parts = [f"Clasificá estos {len(user_msgs)} tickets.\n"]
+        for i, msg in enumerate(user_msgs, 1):
+            parts.append(f"=== Ticket {i} ===\n{msg}")
+        batch_msg = "\n".join(parts)
+        max_tokens = self.batch_tokens_per_ticket * len(user_msgs)
+
+        for attempt in range(max_retries):
+            if attempt:
+                self.metrics.count("reintentos")
+            try:
+                raw, source = self.llm.call(self.batch_system_prompt, batch_msg, max_tokens=max_tokens)
+                with self.metrics.span("parse"):
+                    data, repaired = parse_response(raw)
+                if isinstance(data, dict):
+                    data = data.get("resultados", [])
+                return (data if isinstance(data, list) else []), source, repaired
+            except RateLimitError:
+                continue
+            except Exception:
+                return [], None, False
+        return [], None, False
+
+    def classify_batch(self, tickets):
+        """Classify several tickets with one LLM request.
+
+        Each answer goes through the cascade and _normalize like a single
+        classify; tickets that are missing or malformed in the response are
+        retried one by one.
+        """
+        results = [None] * len(tickets)
+        todo = []
+        for i, t in enumerate(tickets):
+            result, pinned, user_msg, cache_key = self._prepare(
+                t["key"], t.get("title", ""), t.get("description", ""), t.get("labels"), t.get("components"),
+            )
+            if result is not None:
+                results[i] = result
+            else:
+                todo.append((i, t["key"], pinned, user_msg, cache_key))
+
+        if len(todo) > 1:
+            answers = {}
+            with self.metrics.bind(todo[0][1]), self.metrics.span("lote", tickets=len(todo)):
+                items, source, repaired = self._request_batch([msg for _, _, _, msg, _ in todo])
+            for item in map(expand_compact, items):
+                if isinstance(item, dict) and item.get("TICKET"):
+                    answers[str(item.pop("TICKET")).strip()] = item
+            self._count("requests_lote")
+            missing = []
+            for i, key, pinned, user_msg, cache_key in todo:
+                answer = answers.get(key)
+                try:
+                    _check_answer(answer)
+                except ValueError:
+                    missing.append((i, key, pinned, user_msg, cache_key))
+                    continue
+                if repaired:
+                    self._repaired()
+                with self.metrics.bind(key):
+                    answer, answer_source, tier = self._escalate(answer, repaired, source, pinned, user_msg)
+                results[i] = self._finish(answer, pinned, cache_key, answer_source, tier)
+            self._count("reintentos_lote", len(missing))
+            todo = missing
+
+        for i, key, pinned, user_msg, cache_key in todo:
+            with self.metrics.bind(key), self.metrics.span("ticket"):
+                results[i] = self._classify_llm(user_msg, pinned, cache_key)
+        return results
+
+    def _classify_ticket(self, ticket):
+        return self.classify(
+            ticket["key"],
+            ticket.get("title", ""),
+            ticket.get("description", ""),
+            ticket.get("labels"),
+            ticket.get("components"),
+        )
+
+    def _classify_chunk(self, chunk):
+        if len(chunk) == 1:
+            return [self._classify_ticket(chunk[0])]
+        return self.classify_batch(chunk)
+
+    def _input_tokens(self, ticket):
+        return estimate_tokens(build_user_message(
+            ticket["key"], ticket.get("title", ""), ticket.get("description", ""),
+            ticket.get("labels"), ticket.get("components"),
+        ))
+
+    def iter_classify(self, tickets, max_concurrency=4, batch_size=1, clusters=None, baseline=None):
+        """Classify tickets concurrently, yielding (ticket, result) in input order.
+
+        `tickets` is any iterable of dicts shaped like JiraClient.get_issue_details
+        (only "key" is required). At most `max_concurrency` LLM requests are in
+        flight; all of them go through the provider pool's rate limiters, so the
+        provider budgets hold.
+        With batch_size > 1, up to that many tickets (within BATCH_INPUT_TOKENS)
+        go in each request.
+        With `clusters` (a TitleClusters), only one ticket per family of
+        near-duplicates is classified; the others get a copy of its result
+        and every row gets CLUSTER = its representative's key.
+        With `baseline` (a Baseline), tickets unchanged since the previous
+        result file get their old result back without being classified.
+
+        Every ticket is yielded as soon as no classified ticket before it is
+        still waiting for its answer, so reused and grouped tickets don't pile
+        up behind later requests. At most about (2 * max_concurrency + 1) *
+        batch_size tickets are held at a time: past that a partial batch is
+        sent early.
+        """
+        window = max_concurrency * 2
+        limit = (window + 1) * batch_size
+        # One [ticket, result, representative, reused] slot per ticket, in input order.
+        # A result is filled in when its request returns; cluster members copy
+        # their representative's, which is always earlier in the input.
+        queue = deque()
+        results = {}
+        pending = deque()
+        chunk, tokens = [], 0
+
+        def submit():
+            nonlocal chunk, tokens
+            pending.append((chunk, pool.submit(self._classify_chunk, [slot[0] for slot in chunk])))
+            chunk, tokens = [], 0
+
+        def collect(block):
+            # Fill in finished requests in order, waiting for the oldest one if `block`.
+            while pending and (block or pending[0][1].done()):
+                slots, future = pending.popleft()
+                for slot, result in zip(slots, future.result()):
+                    slot[1] = result
+                block = False
+
+        def ready():
+            while queue and (queue[0][1] is not None or queue[0][2] is not None):
+                ticket, result, rep, reused = queue.popleft()
+                if rep is not None:
+                    self._count("agrupados")
+                    result = dict(results[rep])
+                    if result["ANTIGUEDAD"] == "Nuevo":
+                        result = _normalize(result, pre_classify(ticket.get("title", ""))[1])
+                    yield ticket, result | {"CLUSTER": rep}
+                elif reused:
+                    self._count("reutilizados")
+                    yield ticket, result
+                elif clusters is not None:
+                    results[ticket["key"]] = result
+                    yield ticket, result | {"CLUSTER": ticket["key"]}
                 else:
-                    return {f: "" for f in OUTPUT_FIELDS} | {
-                        "ANTIGUEDAD": "ERROR",
-                        "JUSTIFICACION": f"Error: {e}",
-                    }
-
-        return {f: "" for f in OUTPUT_FIELDS} | {
-            "ANTIGUEDAD": "ERROR",
-            "JUSTIFICACION": "Error: rate limit agotado tras reintentos",
-        }
+                    yield ticket, result
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+            try:
+                for ticket in tickets:
+                    previous = baseline.reusable(ticket) if baseline is not None else None
+                    if previous is not None:
+                        queue.append([ticket, previous, None, True])
+                    else:
+                        rep = clusters.assign(ticket) if clusters is not None else None
+                        slot = [ticket, None, rep, False]
+                        queue.append(slot)
+                        if rep is None:
+                            cost = self._input_tokens(ticket)
+                            if chunk and tokens + cost > self.BATCH_INPUT_TOKENS:
+                                submit()
+                            chunk.append(slot)
+                            tokens += cost
+                            if len(chunk) >= batch_size:
+                                submit()
+                    collect(block=len(pending) >= window)
+                    yield from ready()
+                    while len(queue) > limit:
+                        if chunk and (not pending or queue[0] is chunk[0]):
+                            submit()
+                        collect(block=True)
+                        yield from ready()
+                if chunk:
+                    submit()
+                while pending:
+                    collect(block=True)
+                    yield from ready()
+                yield from ready()
+            finally:
+                for _, future in pending:
+                    future.cancel()
+
+    def classify_many(self, tickets, max_concurrency=4, batch_size=1):
+        """Classify a list of tickets concurrently. Results come back in input order."""
+        return [result for _, result in self.iter_classify(tickets, max_concurrency, batch_size)]
@@ -0,0 +1,77 @@
+"""Near-duplicate porotos: tickets that only differ by site, tags or a "part N" suffix.
+
+Titles are reduced to a family title (site codes, bracket tags and part
+suffixes stripped, accents folded) and grouped when their character 3-gram
+Jaccard similarity reaches a threshold. Grouping is online and in input
+order: the first ticket of a family is its representative and later ones
+join it, so it works on the streaming pipeline without reading every ticket
+first.
+
+Only tickets whose title rules agree are grouped (same pinned SCOPE and
+COMPLEJIDAD, no Carry Over), because those are the fields that depend on the
+stripped tokens; everything else is shared within a family.
+"""
+
+import re
+import threading
+from collections import Counter
+
+from examples_index import normalize_title
+from rules import SITE_CODES, pre_classify
+
+DEFAULT_THRESHOLD = 0.9
+
+_BRACKET_RE = re.compile(r"\[[^\]]*\]|\([^)]*\)")
+_SITE_RE = re.compile(r"\b(?:" + "|".join(SITE_CODES) + r")\b", re.IGNORECASE)
+_PART_RE = re.compile(r"\b(?:part|parte|fase|etapa|pt)\s*\.?\s*\d+\b|\b\d+\s*/\s*\d+\b|[-–]\s*\d+\s*$",
+                      re.IGNORECASE)
+
+
+def family_title(title):
+    """The title without site codes, bracket tags and part suffixes, normalized."""
+    text = _BRACKET_RE.sub(" ", title or "")
+    text = _SITE_RE.sub(" ", text)
+    text = _PART_RE.sub(" ", text)
+    return normalize_title(text)
+
+
+def _shingles(text):
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TitleClusters:
+    """Assigns each ticket to the first earlier ticket it nearly duplicates."""
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self.representatives = {}   # group -> [(key, shingles)]
+        self.postings = {}          # (group, shingle) -> [cluster index]
+        self._lock = threading.Lock()
+
+    def assign(self, ticket):
+        """Key of the representative `ticket` belongs to, or None if it starts a new cluster
+        (or can't be grouped: empty title, or decided by the rules alone)."""
+        title = ticket.get("title", "")
+        ruled, pinned = pre_classify(title)
+        family = family_title(title)
+        if ruled is not None or not family:
+            return None
+        group = tuple(sorted(pinned.items()))
+        shingles = _shingles(family)
+        with self._lock:
+            reps = self.representatives.setdefault(group, [])
+            overlap = Counter()
+            for s in shingles:
+                overlap.update(self.postings.get((group, s), ()))
+            best, best_score = None, 0.0
+            for i, shared in overlap.items():
+                score = shared / (len(shingles) + len(reps[i][1]) - shared)
+                if score > best_score:
+                    best, best_score = i, score
+            if best is not None and best_score >= self.threshold:
+                return reps[best][0]
+            for s in shingles:
+                self.postings.setdefault((group, s), []).append(len(reps))
+            reps.append((ticket["key"], shingles))
+        return None
@@ -0,0 +1,224 @@
+"""Index of previously classified porotos, used to pick few-shot examples.
+
+Titles are turned into TF-IDF vectors of hashed character n-grams (3 to 5)
+and kept as an inverted index in NumPy arrays, so the top-k most similar
+past porotos for a new title are found with a few array operations. The
+index is saved as a single .npz and loads in milliseconds.
+
+Build it from past output CSVs (main.py format):
+    python examples_index.py build RESULTADO_Q1.csv RESULTADO_Q2.csv [--output .cache/ejemplos.npz]
+"""
+
+import argparse
+import csv
+import json
+import re
+import sys
+import unicodedata
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+DEFAULT_PATH = Path(__file__).resolve().parent / ".cache" / "ejemplos.npz"
+
+N_FEATURES = 1 << 20
+NGRAM_SIZES = (3, 4, 5)
+
+_SHORT = {
+    "Mejora o modificacion de conexion existente": "Mejora",
+    "Poroto abarca solo un flujo": "solo un flujo",
+    "Poroto abarca mas de un flujo": "mas de un flujo",
+}
+
+
+def normalize_title(title):
+    text = unicodedata.normalize("NFKD", title.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^\w&/]+", " ", text).split())
+
+
+def _features(title):
+    """{hashed n-gram: sublinear tf} for a title."""
+    text = f" {normalize_title(title)} "
+    counts = {}
+    for n in NGRAM_SIZES:
+        for i in range(len(text) - n + 1):
+            h = zlib.crc32(text[i:i + n].encode("utf-8")) % N_FEATURES
+            counts[h] = counts.get(h, 0) + 1
+    return {h: 1 + np.log(c) for h, c in counts.items()}
+
+
+def _read_outputs(paths):
+    """(key, title, classification) rows from output CSVs, skipping errors and untitled rows."""
+    rows = {}
+    for path in paths:
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            for rec in csv.DictReader(f, delimiter=";"):
+                title = (rec.get("resumen") or "").strip()
+                if not title or rec.get("ANTIGUEDAD") in ("", "ERROR", None):
+                    continue
+                rows[rec.get("clave") or title] = (title, {
+                    "ANTIGUEDAD": rec.get("ANTIGUEDAD", ""),
+                    "TIPO_DE_PRODUCTO": rec.get("TIPO_DE_PRODUCTO", ""),
+                    "SCOPE": rec.get("SCOPE", ""),
+                    "COMPLEJIDAD": rec.get("COMPLEJIDAD", ""),
+                })
+    return [(key, title, labels) for key, (title, labels) in rows.items()]
+
+
+class ExampleIndex:
+    def __init__(self, keys, titles, labels, idf, feature_ptr, doc_ids, weights):
+        self.keys = keys
+        self.titles = titles
+        self.labels = labels
+        self.idf = idf
+        self.feature_ptr = feature_ptr
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self._slots = {int(f): i for i, f in enumerate(idf["features"])}
+
+    def __len__(self):
+        return len(self.titles)
+
+    @classmethod
+    def build(cls, rows):
+        """Index (key, title, labels) rows; later rows win for repeated keys."""
+        keys, titles, labels = [], [], []
+        docs = []
+        for key, title, label in rows:
+            keys.append(key)
+            titles.append(title)
+            labels.append(label)
+            docs.append(_features(title))
+
+        df = {}
+        for doc in docs:
+            for h in doc:
+                df[h] = df.get(h, 0) + 1
+        features = np.array(sorted(df), dtype=np.int64)
+        slot = {int(h): i for i, h in enumerate(features)}
+        idf_values = np.log((len(docs) + 1) / (np.array([df[int(h)] for h in features]) + 1)) + 1
+
+        postings = [[] for _ in features]
+        for d, doc in enumerate(docs):
+            vec = {slot[h]: tf * idf_values[slot[h]] for h, tf in doc.items()}
+            norm = np.sqrt(sum(v * v for v in vec.values())) or 1.0
+            for s, v in vec.items():
+                postings[s].append((d, v / norm))
+
+        feature_ptr = np.zeros(len(features) + 1, dtype=np.int64)
+        feature_ptr[1:] = np.cumsum([len(p) for p in postings])
+        doc_ids = np.array([d for p in postings for d, _ in p], dtype=np.int32)
+        weights = np.array([w for p in postings for _, w in p], dtype=np.float32)
+        idf = {"features": features, "values": idf_values.astype(np.float32)}
+        return cls(keys, titles, labels, idf, feature_ptr, doc_ids, weights)
+
+    @classmethod
+    def from_csvs(cls, paths):
+        return cls.build(_read_outputs(paths))
+
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            np.savez_compressed(
+                f,
+                keys=np.array(self.keys, dtype=str),
+                titles=np.array(self.titles, dtype=str),
+                labels=np.array(json.dumps(self.labels, ensure_ascii=False)),
+                features=self.idf["features"],
+                idf=self.idf["values"],
+                feature_ptr=self.feature_ptr,
+                doc_ids=self.doc_ids,
+                weights=self.weights,
+            )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                data["keys"].tolist(),
+                data["titles"].tolist(),
+                json.loads(str(data["labels"])),
+                {"features": data["features"], "values": data["idf"]},
+                data["feature_ptr"],
+                data["doc_ids"],
+                data["weights"],
+            )
+
+    def search(self, title, k=5, exclude_key=None):
+        """The k most similar indexed porotos as (score, key, title, labels), best first."""
+        query = {}
+        for h, tf in _features(title).items():
+            s = self._slots.get(h)
+            if s is not None:
+                query[s] = tf * float(self.idf["values"][s])
+        if not query:
+            return []
+        norm = np.sqrt(sum(v * v for v in query.values()))
+        # Gather the postings of every query n-gram and sum them per document.
+        slots = np.fromiter(query, dtype=np.int64)
+        q = np.fromiter(query.values(), dtype=np.float32) / norm
+        lo, hi = self.feature_ptr[slots], self.feature_ptr[slots + 1]
+        lengths = hi - lo
+        starts = np.repeat(lo - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        positions = starts + np.arange(lengths.sum())
+        scores = np.bincount(self.doc_ids[positions], weights=self.weights[positions] * np.repeat(q, lengths),
+                             minlength=len(self.titles))
+
+        candidates = np.flatnonzero(scores)
+        found, seen = [], set()
+        for d in candidates[np.argsort(-scores[candidates], kind="stable")]:
+            if len(found) == k:
+                break
+            if self.keys[d] == exclude_key or self.titles[d] in seen:
+                continue
+            seen.add(self.titles[d])
+            found.append((float(scores[d]), self.keys[d], self.titles[d], self.labels[d]))
+        return found
+
+    def render(self, title, k=5, exclude_key=None):
+        """The "EJEMPLOS SIMILARES" block for a user message ("" if nothing matches)."""
+        lines = []
+        for _, _, past_title, labels in self.search(title, k, exclude_key):
+            if labels["ANTIGUEDAD"] != "Nuevo":
+                lines.append(f'"{past_title}" → {labels["ANTIGUEDAD"]}, campos 2-5 vacíos.')
+                continue
+            values = [labels["ANTIGUEDAD"]] + [
+                _SHORT.get(labels[f], labels[f]) for f in ("TIPO_DE_PRODUCTO", "SCOPE", "COMPLEJIDAD")
+            ]
+            lines.append(f'"{past_title}" → {", ".join(values)}.')
+        if not lines:
+            return ""
+        return "## EJEMPLOS SIMILARES\n" + "\n".join(lines) + "\n\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Índice de porotos ya clasificados para elegir ejemplos")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="indexar CSVs de salida de corridas anteriores")
+    build.add_argument("csvs", nargs="+", help="CSVs de salida (formato de main.py)")
+    build.add_argument("--output", default=str(DEFAULT_PATH), help=f"archivo .npz (default: {DEFAULT_PATH})")
+    search = sub.add_parser("search", help="probar el índice con un título")
+    search.add_argument("title")
+    search.add_argument("--index", default=str(DEFAULT_PATH))
+    search.add_argument("-k", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        missing = [p for p in args.csvs if not Path(p).exists()]
+        if missing:
+            print(f"Error: no encontrado: {', '.join(missing)}")
+            sys.exit(1)
+        index = ExampleIndex.from_csvs(args.csvs)
+        index.save(args.output)
+        print(f"Índice con {len(index)} porotos guardado en {args.output}")
+    else:
+        index = ExampleIndex.load(args.index)
+        for score, key, title, labels in index.search(args.title, args.k):
+            print(f"{score:.2f}  {key}  {title}  → {', '.join(v for v in labels.values() if v)}")
+
+
+if __name__ == "__main__":
+    main()
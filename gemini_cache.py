@@ -0,0 +1,130 @@
+"""Gemini context caching (cachedContents) for the fixed system prompt.
+
+Instead of resending system_instruction on every generateContent, the prompt
+is stored once as a cachedContents entry and each request references it by
+name. Entries belong to the project of the API key that created them, so they
+are kept in a small JSON file keyed by API key + model + prompt hash, and
+later runs with the same key reuse them while their TTL lasts. If Gemini refuses to cache (the
+prompt is under the model's minimum size, or the model doesn't support it),
+the model/prompt is marked and requests go out with the inline
+system_instruction as before. Other failures (429, 5xx, network) only pause
+creation for `retry_seconds`; requests meanwhile go out inline.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+
+def _parse_time(value):
+    # Gemini returns RFC 3339 with up to nanoseconds: "2026-01-01T00:00:00.123456789Z".
+    value = value.rstrip("Z")
+    if "." in value:
+        head, frac = value.split(".", 1)
+        value = f"{head}.{frac[:6]}"
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc)
+
+
+# 400/404 messages that mean this prompt or model can never be cached.
+_UNSUPPORTED_RE = re.compile(r"too small|min_total_token_count|not supported|does not support", re.IGNORECASE)
+
+
+def _unsupported(resp):
+    return resp.status_code in (400, 404) and bool(_UNSUPPORTED_RE.search(resp.text or ""))
+
+
+_GONE_RE = re.compile(r"not found|expired|does not exist", re.IGNORECASE)
+
+
+def entry_gone(resp):
+    """Whether an error answer to a request that references an entry means the entry no longer exists."""
+    return resp.status_code == 404 or (resp.status_code in (400, 403) and bool(_GONE_RE.search(resp.text or "")))
+
+
+class GeminiContextCache:
+    def __init__(self, path=None, ttl_seconds=3600, margin_seconds=120, retry_seconds=60):
+        self.path = Path(path) if path else None
+        self.ttl_seconds = ttl_seconds
+        self.margin = timedelta(seconds=margin_seconds)
+        self.retry_seconds = retry_seconds
+        self.entries = {}
+        self.unsupported = set()
+        self._creating = set()
+        self._retry_at = {}
+        self._lock = threading.Lock()
+        if self.path and self.path.exists():
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    @staticmethod
+    def _key(provider, system_prompt):
+        # Hashed together with the rest, so the file never holds the API key itself.
+        return hashlib.sha256(f"{provider.api_key}\0{provider.model}\0{system_prompt}".encode("utf-8")).hexdigest()
+
+    def _save(self):
+        if not self.path:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.path)
+
+    def get(self, provider, system_prompt):
+        """cachedContents name holding `system_prompt` for provider.model, creating it if needed.
+
+        Returns None when caching isn't available, or while another thread is
+        creating the entry; the caller then sends the prompt inline.
+        """
+        key = self._key(provider, system_prompt)
+        with self._lock:
+            if key in self.unsupported or key in self._creating:
+                return None
+            entry = self.entries.get(key)
+            now = datetime.now(timezone.utc)
+            if entry and _parse_time(entry["expire_time"]) - self.margin > now:
+                return entry["name"]
+            if self._retry_at.get(key, 0) > time.monotonic():
+                return None
+            self._creating.add(key)
+
+        # The POST runs outside the lock so other workers aren't held up by it.
+        resp, entry = None, None
+        try:
+            root = provider.base_url.split("/models/", 1)[0]
+            resp = provider.session.post(f"{root}/cachedContents?key={provider.api_key}", json={
+                "model": f"models/{provider.model}",
+                "systemInstruction": {"parts": [{"text": system_prompt}]},
+                "ttl": f"{self.ttl_seconds}s",
+            }, timeout=30)
+            if resp.ok:
+                data = resp.json()
+                expire = data.get("expireTime") or (now + timedelta(seconds=self.ttl_seconds)).strftime("%Y-%m-%dT%H:%M:%SZ")
+                entry = {"name": data["name"], "expire_time": expire}
+        except Exception:
+            pass
+        with self._lock:
+            self._creating.discard(key)
+            if entry:
+                self.entries[key] = entry
+                self._save()
+                return entry["name"]
+            if resp is not None and _unsupported(resp):
+                self.unsupported.add(key)
+            else:
+                self._retry_at[key] = time.monotonic() + self.retry_seconds
+            return None
+
+    def invalidate(self, provider, system_prompt):
+        """Forget an entry Gemini no longer knows (deleted or expired early)."""
+        with self._lock:
+            if self.entries.pop(self._key(provider, system_prompt), None) is not None:
+                self._save()
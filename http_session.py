@@ -0,0 +1,27 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+def build_session(pool_size=10, retries=3, backoff_factor=0.5):
+    """Keep-alive requests.Session with `pool_size` connections per host.
+
+    Connection errors are retried by the adapter with exponential backoff,
+    and so are 5xx and read errors for idempotent methods (urllib3's default
+    set). POSTs are not resent once they reached the server: LLM completions
+    are billed per call and Batch API creates aren't idempotent, so those
+    retries are left to the callers, as is 429.
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
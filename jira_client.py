@@ -1,42 +1,99 @@
-import requests
+import re
+
+from requests import RequestException
 from requests.auth import HTTPBasicAuth
 import time
 
+from http_session import build_session
+from metrics import RunMetrics
+
+ISSUE_FIELDS = ["summary", "description", "labels", "components", "status", "issuetype", "updated"]
+
+_INVALID_KEY_RE = re.compile(r"'([A-Z][A-Z0-9]+-\d+)'")
+
+
+class JiraSearchError(Exception):
+    def __init__(self, messages):
+        self.messages = messages
+        super().__init__("; ".join(messages) or "JQL rechazado por Jira")
+
+
+class JiraUnavailableError(Exception):
+    """A JQL search stopped midway: Jira kept rate limiting, failed or couldn't be reached."""
+
 
 class JiraClient:
-    def __init__(self, base_url, email, api_token):
+    def __init__(self, base_url, email, api_token, page_size=100, session=None, pool_size=10, metrics=None):
         self.base_url = base_url.rstrip("/")
         self.auth = HTTPBasicAuth(email, api_token)
         self.headers = {"Accept": "application/json"}
+        self.page_size = page_size
+        self._owns_session = session is None
+        self.session = session or build_session(pool_size)
+        self.metrics = metrics or RunMetrics()
+
+    def close(self):
+        if self._owns_session:
+            self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
     def get_issue(self, issue_key, max_retries=3):
         url = f"{self.base_url}/rest/api/3/issue/{issue_key}"
         params = {
-            "fields": "summary,description,labels,components,status,issuetype"
+            "fields": ",".join(ISSUE_FIELDS)
         }
 
         for attempt in range(max_retries):
-            try:
-                resp = requests.get(
-                    url,
-                    headers=self.headers,
-                    auth=self.auth,
-                    params=params,
-                    timeout=15,
-                )
-                if resp.status_code == 200:
-                    return resp.json()
-                if resp.status_code == 404:
-                    return None
-                if resp.status_code == 429:
-                    time.sleep(5 * (attempt + 1))
-                    continue
-                resp.raise_for_status()
-            except requests.exceptions.RequestException:
-                if attempt < max_retries - 1:
-                    time.sleep(2 * (attempt + 1))
-                else:
-                    raise
+            resp = self.session.get(
+                url,
+                headers=self.headers,
+                auth=self.auth,
+                params=params,
+                timeout=15,
+            )
+            if resp.status_code == 200:
+                return resp.json()
+            if resp.status_code == 404:
+                return None
+            if resp.status_code == 429:
+                time.sleep(5 * (attempt + 1))
+                continue
+            resp.raise_for_status()
+        return None
+
+    def search(self, jql, next_page_token=None, max_retries=3):
+        """Run one page of a JQL search. Raises JiraSearchError if Jira rejects the JQL."""
+        url = f"{self.base_url}/rest/api/3/search/jql"
+        payload = {"jql": jql, "fields": ISSUE_FIELDS, "maxResults": self.page_size}
+        if next_page_token:
+            payload["nextPageToken"] = next_page_token
+
+        for attempt in range(max_retries):
+            resp = self.session.post(
+                url,
+                headers=self.headers,
+                auth=self.auth,
+                json=payload,
+                timeout=30,
+            )
+            if resp.status_code == 200:
+                return resp.json()
+            if resp.status_code == 400:
+                try:
+                    messages = resp.json().get("errorMessages", [])
+                except ValueError:
+                    messages = [resp.text[:200]] if resp.text else []
+                raise JiraSearchError(messages)
+            # A search is read-only, so it is safe to resend after a 5xx.
+            if resp.status_code == 429 or (resp.status_code >= 500 and attempt < max_retries - 1):
+                time.sleep(5 * (attempt + 1))
+                continue
+            resp.raise_for_status()
         return None
 
     @staticmethod
@@ -59,14 +116,10 @@ class JiraClient:
 
         return " ".join(filter(None, parts))
 
-    def get_issue_details(self, issue_key):
-        """Fetch and return structured ticket data."""
-        issue = self.get_issue(issue_key)
-        if issue is None:
-            return None
-
+    def _issue_to_details(self, issue, issue_key):
         fields = issue.get("fields", {})
-        desc_text = self._extract_text_from_adf(fields.get("description"))
+        with self.metrics.span("adf", key=issue_key):
+            desc_text = self._extract_text_from_adf(fields.get("description"))
 
         return {
             "key": issue_key,
@@ -76,4 +129,109 @@ class JiraClient:
             "components": [c.get("name", "") for c in fields.get("components", [])],
             "status": fields.get("status", {}).get("name", ""),
             "issue_type": fields.get("issuetype", {}).get("name", ""),
+            "updated": fields.get("updated", ""),
         }
+
+    def get_issue_details(self, issue_key):
+        """Fetch and return structured ticket data."""
+        with self.metrics.span("jira", key=issue_key, tickets=1):
+            issue = self.get_issue(issue_key)
+        if issue is None:
+            return None
+        return self._issue_to_details(issue, issue_key)
+
+    def _search_or_raise(self, jql, next_page_token=None):
+        """search(), raising JiraUnavailableError when Jira can't answer (429s exhausted, 5xx, network)."""
+        try:
+            data = self.search(jql, next_page_token=next_page_token)
+        except RequestException as e:
+            raise JiraUnavailableError(f"Jira no respondió a la búsqueda: {e}") from e
+        if data is None:
+            raise JiraUnavailableError("Jira no respondió a la búsqueda (rate limit agotado)")
+        return data
+
+    def iter_search(self, jql):
+        """Yield the details of every ticket matching `jql`, one page at a time.
+
+        Pages are fetched with nextPageToken as the caller consumes them, so only
+        the current page is held in memory. Raises JiraSearchError if Jira
+        rejects the JQL, and JiraUnavailableError if a page can't be fetched.
+        """
+        token = None
+        while True:
+            with self.metrics.span("jira", key="jql"):
+                data = self._search_or_raise(jql, next_page_token=token)
+            for issue in data.get("issues", []):
+                if "key" in issue:
+                    yield self._issue_to_details(issue, issue["key"])
+            token = data.get("nextPageToken")
+            if not token or data.get("isLast"):
+                return
+
+    def _search_keys(self, keys):
+        """Fetch a chunk with one `key in (...)` search.
+
+        Returns (issues by key, keys Jira reported as nonexistent), or None if Jira
+        rejected the JQL for another reason. Raises JiraUnavailableError if Jira
+        can't answer (rate limited, down).
+        """
+        jql = f"key in ({', '.join(keys)})"
+        try:
+            with self.metrics.span("jira", key=keys[0], tickets=len(keys)):
+                data = self._search_or_raise(jql)
+        except JiraSearchError as e:
+            invalid = {k for msg in e.messages for k in _INVALID_KEY_RE.findall(msg)} & set(keys)
+            valid = [k for k in keys if k not in invalid]
+            if not invalid:
+                return None
+            if not valid:
+                return {}, invalid
+            retry = self._search_keys(valid)
+            if retry is None:
+                return None
+            return retry[0], retry[1] | invalid
+
+        issues = list(data.get("issues", []))
+        token = data.get("nextPageToken")
+        while token and not data.get("isLast", True):
+            data = self._search_or_raise(jql, next_page_token=token)
+            issues.extend(data.get("issues", []))
+            token = data.get("nextPageToken")
+        return {issue["key"]: issue for issue in issues if "key" in issue}, set()
+
+    def get_issues_details(self, issue_keys, on_error=None):
+        """Fetch many tickets with chunked JQL searches.
+
+        Returns a dict key -> details (same shape as get_issue_details); keys that
+        do not exist are left out. Keys a search answered without (moved issues,
+        chunks whose JQL Jira rejected) fall back to one GET each; a GET that
+        fails (restricted issue, 5xx) leaves out only that key. A chunk Jira
+        can't search at all (429s exhausted, down) is left out whole instead of
+        turning into a GET per key against the same limit. Failures are
+        reported to on_error(keys, e).
+        """
+        keys = list(dict.fromkeys(issue_keys))
+        details = {}
+        for i in range(0, len(keys), self.page_size):
+            chunk = keys[i:i + self.page_size]
+            try:
+                found, invalid = self._search_keys(chunk) or ({}, set())
+            except JiraUnavailableError as e:
+                self.metrics.count("errores_jira", len(chunk), key=chunk[0])
+                if on_error:
+                    on_error(chunk, e)
+                continue
+            for key in chunk:
+                if key in found:
+                    details[key] = self._issue_to_details(found[key], key)
+                elif key not in invalid:
+                    try:
+                        d = self.get_issue_details(key)
+                    except Exception as e:
+                        self.metrics.count("errores_jira", key=key)
+                        if on_error:
+                            on_error([key], e)
+                        continue
+                    if d:
+                        details[key] = d
+        return details
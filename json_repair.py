@@ -0,0 +1,122 @@
+"""Tolerant parsing of LLM answers that are almost JSON.
+
+Handles markdown fences, text around the object, single quotes, smart
+quotes, Python literals, trailing commas and answers cut off by max_tokens
+(e.g. in the middle of JUSTIFICACION).
+"""
+
+import json
+import re
+
+_FENCE_RE = re.compile(r"^```[a-zA-Z]*\s*|\s*```$")
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_SINGLE_QUOTED_RE = re.compile(r"(?<=[{,:\[])(\s*)'((?:[^'\\]|\\.)*)'")
+_PY_LITERALS = {"None": "null", "True": "true", "False": "false"}
+_PY_LITERAL_RE = re.compile(r"(?<=[:\[,])(\s*)(None|True|False)\b")
+_FIELD_RE = re.compile(r"""["']?([A-Z_]{4,})["']?\s*:\s*["']([^"'\n]*)""")
+
+
+def _scan(text):
+    """Walk text as JSON. Returns (end index of the first complete value or None, open brackets, in_string)."""
+    stack = []
+    in_string = escaped = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if stack and stack[-1] == ch:
+                stack.pop()
+            if not stack:
+                return i, [], False
+    return None, stack, in_string
+
+
+def extract_json(text):
+    """The first JSON object/array in text; everything after its start if it never closes."""
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        return None
+    text = text[min(starts):]
+    end, _, _ = _scan(text)
+    return text if end is None else text[:end + 1]
+
+
+def _close(text):
+    """Terminate a truncated value: close the open string and brackets."""
+    _, stack, in_string = _scan(text)
+    if in_string:
+        text += '"'
+    text = text.rstrip()
+    if text.endswith(","):
+        text = text[:-1]
+    elif text.endswith(":"):
+        text += '""'
+    elif re.search(r'[{,]\s*"[^"]*"$', text):
+        text += ':""'
+    return text + "".join(reversed(stack))
+
+
+def repair_json(text):
+    text = text.replace("“", '"').replace("”", '"').replace("‘", "'").replace("’", "'")
+    text = _SINGLE_QUOTED_RE.sub(lambda m: m.group(1) + json.dumps(m.group(2).replace("\\'", "'")), text)
+    text = _PY_LITERAL_RE.sub(lambda m: m.group(1) + _PY_LITERALS[m.group(2)], text)
+    text = _close(text)
+    return _TRAILING_COMMA_RE.sub(r"\1", text)
+
+
+def parse_response(raw):
+    """Parse an LLM answer. Returns (value, repaired); raises ValueError if nothing usable is found."""
+    text = _FENCE_RE.sub("", raw.strip())
+    try:
+        return json.loads(text), False
+    except ValueError:
+        pass
+
+    candidate = extract_json(text)
+    if candidate:
+        for attempt in (candidate, repair_json(candidate)):
+            try:
+                return json.loads(attempt), True
+            except ValueError:
+                continue
+
+    fields = dict(_FIELD_RE.findall(text))
+    if fields:
+        return fields, True
+    raise ValueError("Respuesta sin JSON utilizable")
+
+
+class JsonStream:
+    """A JSON object arriving in chunks (streamed LLM answer).
+
+    `fields` holds the top-level string fields whose value is already
+    complete; `complete` turns true once the object's closing brace arrives.
+    """
+
+    _STRING_FIELD_RE = re.compile(r'"([^"\\]+)"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+    def __init__(self):
+        self.text = ""
+        self.fields = {}
+
+    def feed(self, chunk):
+        self.text += chunk
+        for m in self._STRING_FIELD_RE.finditer(self.text):
+            if m.group(1) not in self.fields:
+                self.fields[m.group(1)] = json.loads(f'"{m.group(2)}"')
+        return self.fields
+
+    @property
+    def complete(self):
+        start = self.text.find("{")
+        return start >= 0 and _scan(self.text[start:])[0] is not None
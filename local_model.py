@@ -0,0 +1,206 @@
+"""Local classifier trained on previous runs, used before asking the LLM.
+
+A multinomial logistic regression over hashed features of the title (word
+unigrams/bigrams and character n-grams). Only the title is used, since it is
+all the output CSVs it trains on record about a ticket. The class is
+the whole classification ("Nuevo|TIPO|SCOPE|COMPLEJIDAD", "Carry Over" or
+"N/A"), so its probability is a confidence for the ticket as a whole:
+PorotoclassifierLLM only calls the LLM when it is below the threshold.
+Training is plain SGD on the CPU and takes seconds for a few thousand rows.
+
+Train it from past output CSVs (main.py format):
+    python local_model.py train RESULTADO_Q1.csv RESULTADO_Q2.csv [--output .cache/modelo_local.npz]
+"""
+
+import argparse
+import csv
+import sys
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+from examples_index import normalize_title
+
+DEFAULT_PATH = Path(__file__).resolve().parent / ".cache" / "modelo_local.npz"
+DEFAULT_THRESHOLD = 0.9
+
+N_FEATURES = 1 << 18
+CHAR_NGRAMS = (3, 4, 5)
+LABEL_FIELDS = ["ANTIGUEDAD", "TIPO_DE_PRODUCTO", "SCOPE", "COMPLEJIDAD"]
+
+
+def _hash(token):
+    return zlib.crc32(token.encode("utf-8")) % N_FEATURES
+
+
+def featurize(title):
+    """(feature indices, L2-normalized values) for one ticket title."""
+    text = normalize_title(title or "")
+    counts = {}
+
+    def add(token):
+        h = _hash(token)
+        counts[h] = counts.get(h, 0) + 1
+
+    words = text.split()
+    for i, word in enumerate(words):
+        add(f"w:{word}")
+        if i:
+            add(f"b:{words[i - 1]} {word}")
+    padded = f" {text} "
+    for n in CHAR_NGRAMS:
+        for i in range(len(padded) - n + 1):
+            add(f"c:{padded[i:i + n]}")
+
+    indices = np.fromiter(counts, dtype=np.int64, count=len(counts))
+    values = 1 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+    return indices, values / (np.linalg.norm(values) or 1.0)
+
+
+def _label(rec):
+    if rec["ANTIGUEDAD"] != "Nuevo":
+        return rec["ANTIGUEDAD"]
+    return "|".join(rec[f] for f in LABEL_FIELDS)
+
+
+def read_training_rows(paths):
+    """(title, class) pairs from output CSVs; the last row wins for a repeated key.
+
+    Errors and rows the local model answered itself are left out, so it never
+    learns from its own guesses.
+    """
+    rows = {}
+    for path in paths:
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            for rec in csv.DictReader(f, delimiter=";"):
+                title = (rec.get("resumen") or "").strip()
+                if not title or rec.get("ANTIGUEDAD") in ("", "ERROR", None) or rec.get("MODELO") == "local":
+                    continue
+                rows[rec.get("clave") or title] = (title, _label({f: rec.get(f) or "" for f in LABEL_FIELDS}))
+    return list(rows.values())
+
+
+class LocalModel:
+    def __init__(self, classes, rows, weights, bias):
+        self.classes = classes
+        self.rows = rows          # sorted feature indices that have weights
+        self.weights = weights    # len(rows) x len(classes)
+        self.bias = bias
+
+    @classmethod
+    def train(cls, samples, epochs=10, learning_rate=0.5, l2=1e-6, seed=0):
+        """Fit on (title, class) pairs."""
+        classes = sorted({label for _, label in samples})
+        class_index = {c: i for i, c in enumerate(classes)}
+        X = [featurize(title) for title, _ in samples]
+        y = np.array([class_index[label] for _, label in samples])
+
+        W = np.zeros((N_FEATURES, len(classes)), dtype=np.float32)
+        b = np.zeros(len(classes), dtype=np.float32)
+        rng = np.random.default_rng(seed)
+        for epoch in range(epochs):
+            rate = learning_rate / (1 + epoch)
+            for i in rng.permutation(len(X)):
+                idx, val = X[i]
+                z = val @ W[idx] + b
+                p = np.exp(z - z.max())
+                p /= p.sum()
+                p[y[i]] -= 1
+                W[idx] -= rate * (np.outer(val, p) + l2 * W[idx])
+                b -= rate * p
+
+        rows = np.flatnonzero(np.abs(W).max(axis=1) > 1e-6)
+        return cls(classes, rows, W[rows], b)
+
+    def probabilities(self, title):
+        idx, val = featurize(title)
+        pos = np.searchsorted(self.rows, idx)
+        known = pos < len(self.rows)
+        known[known] = self.rows[pos[known]] == idx[known]
+        z = val[known] @ self.weights[pos[known]] + self.bias
+        p = np.exp(z - z.max())
+        return p / p.sum()
+
+    def predict(self, title):
+        """(classification fields, confidence) for one ticket title."""
+        p = self.probabilities(title)
+        best = int(p.argmax())
+        values = self.classes[best].split("|")
+        return dict(zip(LABEL_FIELDS, values)), float(p[best])
+
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            np.savez_compressed(f, classes=np.array(self.classes, dtype=str), rows=self.rows,
+                                weights=self.weights, bias=self.bias)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["classes"].tolist(), data["rows"], data["weights"], data["bias"])
+
+
+def evaluate(model, samples, threshold):
+    """(accuracy, share of samples at or above threshold, accuracy on that share)."""
+    hits = confident = confident_hits = 0
+    for title, label in samples:
+        p = model.probabilities(title)
+        best = int(p.argmax())
+        hit = model.classes[best] == label
+        hits += hit
+        if p[best] >= threshold:
+            confident += 1
+            confident_hits += hit
+    n = len(samples) or 1
+    return hits / n, confident / n, confident_hits / (confident or 1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Modelo local entrenado con corridas anteriores")
+    sub = parser.add_subparsers(dest="command", required=True)
+    train = sub.add_parser("train", help="entrenar con CSVs de salida de corridas anteriores")
+    train.add_argument("csvs", nargs="+", help="CSVs de salida (formato de main.py)")
+    train.add_argument("--output", default=str(DEFAULT_PATH), help=f"archivo del modelo (default: {DEFAULT_PATH})")
+    train.add_argument("--epochs", type=int, default=10)
+    train.add_argument("--holdout", type=float, default=0.2,
+                       help="fracción apartada para medir exactitud antes de entrenar con todo (default: 0.2)")
+    train.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                       help=f"confianza mínima a evaluar (default: {DEFAULT_THRESHOLD})")
+    predict = sub.add_parser("predict", help="probar el modelo con un título")
+    predict.add_argument("title")
+    predict.add_argument("--model", default=str(DEFAULT_PATH))
+    args = parser.parse_args(argv)
+
+    if args.command == "predict":
+        fields, confidence = LocalModel.load(args.model).predict(args.title)
+        print(f"{', '.join(v for v in fields.values() if v)}  (confianza {confidence:.0%})")
+        return
+
+    missing = [p for p in args.csvs if not Path(p).exists()]
+    if missing:
+        print(f"Error: no encontrado: {', '.join(missing)}")
+        sys.exit(1)
+    samples = read_training_rows(args.csvs)
+    if len(samples) < 2:
+        print("Error: hacen falta al menos 2 porotos clasificados para entrenar")
+        sys.exit(1)
+    print(f"Porotos para entrenar: {len(samples)}")
+
+    n_test = int(len(samples) * args.holdout)
+    if n_test:
+        order = np.random.default_rng(0).permutation(len(samples))
+        test = [samples[i] for i in order[:n_test]]
+        model = LocalModel.train([samples[i] for i in order[n_test:]], epochs=args.epochs)
+        accuracy, coverage, confident_accuracy = evaluate(model, test, args.threshold)
+        print(f"Validación ({n_test} porotos): exactitud {accuracy:.1%}; con confianza >= {args.threshold:.0%} "
+              f"responde {coverage:.1%} con exactitud {confident_accuracy:.1%}")
+
+    model = LocalModel.train(samples, epochs=args.epochs)
+    model.save(args.output)
+    print(f"Modelo con {len(model.classes)} clases guardado en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,20 +2,67 @@
 Clasificador automático de Porotos TMO (CLI).
 
 Uso:
-    python main.py <input.csv> [output.csv]
+    python main.py <input.csv> [output.csv] [--workers N] [--jira-workers N]
+    python main.py --jql "project = SMPR AND ..." [output.csv] [opciones]
+                   [--tickets-per-call K] [--compact] [--cascade [--samples N]]
+                   [--hedge P [--hedge-budget F]] [--stream] [--examples [INDICE] [--k N]]
+                   [--local [MODELO] [--threshold C]] [--cluster [UMBRAL]]
+                   [--baseline RESULTADO_ANTERIOR.csv]
+                   [--no-cache | --refresh] [--resume] [--batch [--poll SEGUNDOS]]
+                   [--metrics metrics.jsonl]
+
+La corrida es un pipeline: Jira se lee por adelantado mientras el LLM
+clasifica, y un escritor va guardando los resultados. Con `--jql`, los
+porotos salen directo de la búsqueda de Jira (página a página) en vez de un
+CSV, y la clasificación arranca con la primera página.
+
+Cada poroto se agrega al CSV de salida apenas se clasifica. Si la corrida se
+corta, `--resume` retoma salteando las claves que ya están en el archivo
+(las filas con ERROR se vuelven a clasificar).
+
+Con `--batch` los porotos se mandan juntos a la Batch API del proveedor
+(OpenAI o Groq): más barato y sin rate limit, pero asíncrono. El estado del
+batch queda en <output>.batch.json; si el proceso se corta mientras espera,
+volver a correr con `--batch` sigue esperando el mismo batch.
+
+Con `--examples`, en vez de los ejemplos fijos del prompt cada poroto lleva
+los N más parecidos de corridas anteriores (ver examples_index.py).
+
+Con `--local`, un modelo entrenado con corridas anteriores (ver
+local_model.py) responde los porotos en los que tiene confianza y solo el
+resto va al LLM. Sin API key de LLM, responde todos.
+
+Con `--cluster`, los porotos casi duplicados (mismo título salvo sitio, tags
+entre corchetes o "parte N") se clasifican una sola vez; la columna CLUSTER
+indica de qué poroto se copió cada fila.
+
+Con `--baseline`, los porotos que ya están en el resultado de una corrida
+anterior y no cambiaron en Jira (misma fecha de actualización o mismo
+contenido) se copian de ahí con REUTILIZADO=si; solo se clasifica el resto.
 """
 
+import argparse
 import csv
 import os
 import re
 import sys
+from collections import Counter
 from pathlib import Path
 
 from dotenv import load_dotenv
 from tqdm import tqdm
 
-from classifier import PorotoclassifierLLM, OUTPUT_FIELDS
-from jira_client import JiraClient
+from baseline import Baseline, ticket_fields
+from batch_api import BatchClient, load_state, read_output, render_request, save_state
+from cache import ClassificationCache
+from classifier import PorotoclassifierLLM, OUTPUT_FIELDS, META_FIELDS
+from clustering import DEFAULT_THRESHOLD as CLUSTER_THRESHOLD, TitleClusters
+from examples_index import DEFAULT_PATH as DEFAULT_EXAMPLES_PATH, ExampleIndex
+from gemini_cache import GeminiContextCache
+from local_model import DEFAULT_PATH as DEFAULT_LOCAL_MODEL_PATH, DEFAULT_THRESHOLD, LocalModel
+from jira_client import JiraClient, JiraSearchError, JiraUnavailableError
+from metrics import RunMetrics
+from pipeline import WriterStage, jira_stage, jql_stage
 
 
 def extract_ticket_key(text):
@@ -53,89 +100,448 @@ def read_input_csv(filepath):
     return porotos
 
 
+RESULT_FIELDS = OUTPUT_FIELDS + META_FIELDS
+RESULT_HEADER = ["clave", "resumen"] + RESULT_FIELDS
+
+
+def result_row(ticket, result, fields=None):
+    """Output row for a classified ticket; `fields` replaces the ACTUALIZADO/HASH taken from it."""
+    row = {"key": ticket["key"], "title": ticket.get("title", "")}
+    for f in RESULT_FIELDS:
+        row[f] = result.get(f, "")
+    return row | (fields or ticket_fields(ticket))
+
+
+def _result_row(r):
+    return [r.get("key", ""), r.get("title", ""), *[r.get(f, "") for f in RESULT_FIELDS]]
+
+
 def save_results(results, path):
     with open(path, "w", encoding="utf-8", newline="") as f:
         writer = csv.writer(f, delimiter=";")
-        writer.writerow(["clave", "resumen"] + OUTPUT_FIELDS)
+        writer.writerow(RESULT_HEADER)
         for r in results:
-            writer.writerow([
-                r.get("key", ""),
-                r.get("title", ""),
-                *[r.get(f, "") for f in OUTPUT_FIELDS],
-            ])
+            writer.writerow(_result_row(r))
+
+
+def read_results(path):
+    """Read an output CSV back into result dicts (key, title, OUTPUT_FIELDS and META_FIELDS)."""
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        for rec in csv.DictReader(f, delimiter=";"):
+            row = {"key": rec.get("clave", ""), "title": rec.get("resumen", "")}
+            for field in RESULT_FIELDS:
+                row[field] = rec.get(field) or ""
+            yield row
+
+
+class ResultJournal:
+    """Output CSV written one row at a time, doubling as the run checkpoint.
+
+    Rows are flushed as they are written and fsynced every `fsync_every` rows.
+    With resume=True the existing file is kept (minus ERROR rows, which get
+    reclassified) and `done` holds the keys that can be skipped.
+    """
+
+    def __init__(self, path, resume=False, fsync_every=20):
+        self.path = Path(path)
+        self.fsync_every = fsync_every
+        self.done = set()
+        self.counts = Counter()
+        self._unsynced = 0
+
+        kept = []
+        if resume and self.path.exists():
+            kept = [r for r in read_results(self.path) if r["key"] and r["ANTIGUEDAD"] != "ERROR"]
+
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        save_results(kept, tmp)
+        os.replace(tmp, self.path)
+        for r in kept:
+            self.done.add(r["key"])
+            self.counts[r["ANTIGUEDAD"]] += 1
+
+        self.file = open(self.path, "a", encoding="utf-8", newline="")
+        self.writer = csv.writer(self.file, delimiter=";")
+
+    def write(self, row):
+        self.writer.writerow(_result_row(row))
+        self.file.flush()
+        self.counts[row.get("ANTIGUEDAD", "?")] += 1
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self._unsynced = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+
+def run_pipeline(keys, classifier, jira, journal, workers=4, jira_workers=2, batch_size=1, show_progress=True,
+                 clusters=None, baseline=None, jql=None):
+    """Run the Jira -> LLM -> writer stages over `keys`. Returns how many rows were written.
+
+    With `jql`, the tickets are the search results instead (`keys` is ignored)
+    and those already in the journal are skipped.
+
+    With `clusters` (a TitleClusters), near-duplicate tickets reuse one classification.
+    With `baseline` (a Baseline), tickets unchanged since the previous run reuse its rows.
+
+    Ctrl-C stops the run cleanly; everything already written stays in the journal.
+    """
+    def jira_error(chunk, e):
+        where = chunk[0] if len(chunk) == 1 else f"{chunk[0]}..{chunk[-1]}"
+        tqdm.write(f"  [!] Jira ({where}): {e}")
+
+    total = None if jql else len(keys)
+    bars = [
+        tqdm(total=total, desc=desc, unit="poroto", position=i, disable=not show_progress)
+        for i, desc in enumerate(("Jira", "Clasificando", "Guardado"))
+    ]
+    jira_bar, llm_bar, writer_bar = bars
+    writer = WriterStage(journal, progress=writer_bar)
+
+    if jql:
+        tickets = jql_stage(jira, jql, skip=journal.done, progress=jira_bar)
+    else:
+        tickets = jira_stage(jira, keys, workers=jira_workers, progress=jira_bar, on_error=jira_error)
+    classified = classifier.iter_classify(tickets, max_concurrency=workers, batch_size=batch_size,
+                                          clusters=clusters, baseline=baseline)
+    done = 0
+    try:
+        for ticket, result in classified:
+            writer.put(result_row(ticket, result))
+            llm_bar.update(1)
+            done += 1
+    except KeyboardInterrupt:
+        classified.close()
+        tqdm.write("\nInterrumpido. Volvé a correr con --resume para seguir desde acá.")
+    finally:
+        writer.close()
+        for bar in bars:
+            bar.close()
+    return done
+
+
+def run_batch(keys, classifier, jira, journal, state_path, jira_workers=2, poll_interval=30, show_progress=True,
+              baseline=None, jql=None):
+    """Classify `keys` through the provider's Batch API. Returns how many rows were written.
+
+    Tickets settled by the baseline, the rules or the cache are written right
+    away and the rest go in a single batch. If `state_path` holds an unfinished
+    batch, `keys` are ignored and that batch is awaited instead of submitting a new one.
+    With `jql`, the tickets are the search results instead of `keys`.
+    """
+    def show_status(batch):
+        counts = batch.get("request_counts") or {}
+        tqdm.write(f"  batch {batch['id']}: {batch.get('status')} "
+                   f"({counts.get('completed', 0)}/{counts.get('total', 0)} completados, "
+                   f"{counts.get('failed', 0)} fallidos)")
+
+    provider = classifier.llm.members[0]
+    state = load_state(state_path)
+    done = 0
+    with BatchClient.for_provider(provider) as client:
+        if state is None:
+            lines, pending = [], {}
+            bar = tqdm(total=None if jql else len(keys), desc="Jira", unit="poroto", disable=not show_progress)
+            if jql:
+                tickets = jql_stage(jira, jql, skip=journal.done, progress=bar)
+            else:
+                tickets = jira_stage(jira, keys, workers=jira_workers, progress=bar)
+            for ticket in tickets:
+                previous = baseline.reusable(ticket) if baseline is not None else None
+                if previous is not None:
+                    classifier.stats["reutilizados"] += 1
+                    journal.write(result_row(ticket, previous))
+                    done += 1
+                    continue
+                result, pinned, user_msg, cache_key = classifier.prepare(ticket)
+                if result is not None:
+                    journal.write(result_row(ticket, result))
+                    done += 1
+                    continue
+                lines.append(render_request(provider, ticket["key"], classifier.system_prompt, user_msg,
+                                            classifier.max_tokens))
+                pending[ticket["key"]] = {"title": ticket["title"], "pinned": pinned, "cache_key": cache_key,
+                                          "fields": ticket_fields(ticket)}
+            bar.close()
+            journal.sync()
+            if not pending:
+                return done
+
+            file_id = client.upload("porotos.jsonl", "\n".join(lines) + "\n")
+            batch = client.create(file_id)
+            state = {"batch_id": batch["id"], "source": provider.name, "tickets": pending}
+            save_state(state_path, state)
+            tqdm.write(f"Batch {batch['id']} enviado con {len(pending)} porotos")
+        else:
+            tqdm.write(f"Retomando batch {state['batch_id']} ({len(state['tickets'])} porotos)")
+
+        try:
+            batch = client.wait(state["batch_id"], poll_interval, on_status=show_status)
+        except KeyboardInterrupt:
+            tqdm.write("\nInterrumpido. El batch sigue en el proveedor; volvé a correr con --batch para retomarlo.")
+            return done
+
+        answers = {}
+        for file_id in (batch.get("error_file_id"), batch.get("output_file_id")):
+            if file_id:
+                answers |= read_output(client.download(file_id))
+        for key, info in state["tickets"].items():
+            result = classifier.finish_answer(answers.get(key), info["pinned"], info["cache_key"], state["source"])
+            journal.write(result_row({"key": key, "title": info["title"]}, result, info.get("fields")))
+            done += 1
+        journal.sync()
+    Path(state_path).unlink()
+    return done
+
+
+def print_run_summary(classifier, classified, cache=None):
+    print(f"Reglas: {classifier.stats['reglas']} porotos resueltos sin LLM, "
+          f"{classifier.stats['reglas_parciales']} con campos fijados")
+    if classifier.local_model is not None:
+        print(f"Modelo local: {classifier.stats['local']} porotos resueltos sin LLM")
+    if classifier.stats["reutilizados"]:
+        print(f"Reutilizados: {classifier.stats['reutilizados']} porotos sin cambios desde la corrida anterior")
+    if classifier.stats["agrupados"]:
+        print(f"Agrupados: {classifier.stats['agrupados']} porotos copiados de un casi duplicado")
+    if classifier.stats["requests_lote"]:
+        print(f"Lotes: {classifier.stats['requests_lote']} requests, "
+              f"{classifier.stats['reintentos_lote']} porotos reintentados de a uno")
+    if classifier.escalation is not None:
+        reasons = ", ".join(f"{classifier.stats[f'escalados_{r}']} {r}" for r in ("reparado", "reglas", "titulo", "muestreo"))
+        print(f"Cascada: {classifier.stats['escalados']} porotos escalados al modelo preciso ({reasons})")
+    hedges = sum((pool.hedge_stats for pool in classifier.pools), Counter())
+    if hedges["hedges"]:
+        print(f"Hedging: {hedges['hedges']} requests duplicados, {hedges['hedges_ganados']} ganó el duplicado")
+    if classifier.stats["json_reparados"]:
+        print(f"JSON reparado localmente: {classifier.stats['json_reparados']} porotos")
+    if classifier.pools:
+        print("Proveedores:")
+    tokens_in = tokens_out = tokens_cache = 0
+    for label, stats in (item for pool in classifier.pools for item in pool.summary()):
+        print(f"  {label}: {stats.get('requests', 0)} requests, "
+              f"{stats.get('429', 0)} rate limits, {stats.get('errores', 0)} errores, "
+              f"ritmo final {stats['req_s']:.1f} req/s")
+        tokens_in += stats.get("tokens_in", 0)
+        tokens_out += stats.get("tokens_out", 0)
+        tokens_cache += stats.get("tokens_cache", 0)
+    without_llm = sum(classifier.stats[k] for k in ("reglas", "local", "agrupados", "reutilizados"))
+    llm_tickets = classified - without_llm - (cache.hits if cache else 0)
+    if llm_tickets > 0:
+        print(f"Tokens: {tokens_in} enviados / {tokens_out} recibidos "
+              f"(~{tokens_in / llm_tickets:.0f} / {tokens_out / llm_tickets:.0f} por poroto)")
+        if tokens_cache:
+            print(f"Tokens desde cache de prompt: {tokens_cache} ({tokens_cache / max(tokens_in, 1):.0%} de lo enviado)")
+    if cache:
+        print(f"Cache: {cache.stats}")
+
+    metrics = classifier.metrics
+    metrics.close()
+    print(f"\nTiempos por etapa ({metrics.path or 'en memoria'}):")
+    for line in metrics.format_summary():
+        print(line)
+
+
+def parse_args(argv=None):
+    default_out = str(Path.home() / "Desktop" / "RESULTADO_CLASIFICADO.csv")
+    parser = argparse.ArgumentParser(description="Clasificador automático de Porotos TMO")
+    parser.add_argument("input", nargs="?", help="CSV con los IDs SMPR de los porotos")
+    parser.add_argument("output", nargs="?", help=f"CSV de salida (default: {default_out})")
+    parser.add_argument("--jql", metavar="JQL",
+                        help="clasificar los tickets que devuelve esta búsqueda de Jira en vez de un CSV "
+                             "(el único argumento posicional es entonces el CSV de salida)")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="requests al LLM en paralelo (default: 4)")
+    parser.add_argument("--jira-workers", type=int, default=2,
+                        help="búsquedas a Jira en paralelo, de a 100 tickets (default: 2)")
+    parser.add_argument("--tickets-per-call", type=int, default=1, metavar="K",
+                        help="porotos por request al LLM; >1 agrupa K tickets en un solo prompt (default: 1)")
+    parser.add_argument("--cascade", action="store_true",
+                        help="clasificar con el modelo rápido y pasar al preciso solo los porotos dudosos")
+    parser.add_argument("--samples", type=int, default=1, metavar="N",
+                        help="con --cascade, pedir N respuestas al modelo rápido y escalar si no coinciden (default: 1)")
+    parser.add_argument("--hedge", type=float, metavar="P",
+                        help="duplicar un request que tarda más que el percentil P de las latencias recientes (ej: 95)")
+    parser.add_argument("--hedge-budget", type=float, default=0.1, metavar="F",
+                        help="con --hedge, máximo de requests duplicados como fracción del total (default: 0.1)")
+    parser.add_argument("--stream", action="store_true",
+                        help="recibir las respuestas en streaming y cortarlas apenas alcanzan (Carry Over/N/A)")
+    parser.add_argument("--compact", action="store_true",
+                        help="el LLM responde con códigos cortos que se expanden localmente (menos tokens de salida)")
+    parser.add_argument("--examples", nargs="?", const=str(DEFAULT_EXAMPLES_PATH), metavar="INDICE",
+                        help="usar como ejemplos los porotos más parecidos ya clasificados "
+                             f"(índice de examples_index.py, default: {DEFAULT_EXAMPLES_PATH})")
+    parser.add_argument("--k", type=int, default=5, metavar="N",
+                        help="con --examples, cuántos ejemplos por poroto (default: 5)")
+    parser.add_argument("--local", nargs="?", const=str(DEFAULT_LOCAL_MODEL_PATH), metavar="MODELO",
+                        help="responder con el modelo local los porotos en los que tiene confianza "
+                             f"(modelo de local_model.py, default: {DEFAULT_LOCAL_MODEL_PATH})")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, metavar="C",
+                        help=f"con --local, confianza mínima para no consultar al LLM (default: {DEFAULT_THRESHOLD})")
+    parser.add_argument("--cluster", type=float, nargs="?", const=CLUSTER_THRESHOLD, metavar="UMBRAL",
+                        help="clasificar una sola vez cada grupo de porotos casi duplicados; UMBRAL es la "
+                             f"similitud mínima entre títulos (default: {CLUSTER_THRESHOLD})")
+    parser.add_argument("--baseline", metavar="CSV",
+                        help="CSV de salida de una corrida anterior; los porotos que no cambiaron se copian de ahí")
+    cache_group = parser.add_mutually_exclusive_group()
+    cache_group.add_argument("--no-cache", action="store_true",
+                             help="no leer ni guardar clasificaciones en el cache local")
+    cache_group.add_argument("--refresh", action="store_true",
+                             help="ignorar el cache y reclasificar todo (guarda los resultados nuevos)")
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="JSONL con los tiempos por poroto y etapa (default: <output>.metrics.jsonl)")
+    parser.add_argument("--batch", action="store_true",
+                        help="mandar todo a la Batch API del proveedor (OpenAI/Groq) y esperar el resultado")
+    parser.add_argument("--poll", type=float, default=30, metavar="SEGUNDOS",
+                        help="con --batch, cada cuánto consultar el estado del batch (default: 30)")
+    parser.add_argument("--resume", action="store_true",
+                        help="retomar una corrida cortada, salteando las claves que ya están en el CSV de salida")
+    args = parser.parse_args(argv)
+    if args.jql:
+        if args.output is not None:
+            parser.error("con --jql no hay CSV de entrada; indicá solo el CSV de salida")
+        args.input, args.output = None, args.input
+    elif args.input is None:
+        parser.error("falta el CSV de entrada (o --jql)")
+    if args.output is None:
+        args.output = default_out
+    return args
 
 
 def main():
     script_dir = Path(__file__).resolve().parent
     load_dotenv(script_dir / ".env")
 
-    if len(sys.argv) < 2:
-        print("Uso: python main.py <input.csv> [output.csv]")
-        sys.exit(1)
-
-    input_path = sys.argv[1]
-    default_out = str(Path.home() / "Desktop" / "RESULTADO_CLASIFICADO.csv")
-    output_path = sys.argv[2] if len(sys.argv) > 2 else default_out
+    args = parse_args()
+    input_path = args.input
+    output_path = args.output
 
-    if not os.path.exists(input_path):
+    if input_path and not os.path.exists(input_path):
         print(f"Error: {input_path} no encontrado")
         sys.exit(1)
 
+    cache = None
+    if not args.no_cache:
+        cache = ClassificationCache(script_dir / ".cache" / "clasificaciones.sqlite3", refresh=args.refresh)
+
+    metrics = RunMetrics(args.metrics or f"{os.path.splitext(output_path)[0]}.metrics.jsonl")
+
+    examples = None
+    if args.examples:
+        if not os.path.exists(args.examples):
+            print(f"Error: índice de ejemplos {args.examples} no encontrado "
+                  "(crealo con: python examples_index.py build <salidas.csv>)")
+            sys.exit(1)
+        examples = ExampleIndex.load(args.examples)
+        print(f"[OK] Ejemplos: {len(examples)} porotos en {args.examples}")
+
+    baseline = None
+    if args.baseline:
+        if not os.path.exists(args.baseline):
+            print(f"Error: {args.baseline} no encontrado")
+            sys.exit(1)
+        baseline = Baseline.load(args.baseline)
+        print(f"[OK] Corrida anterior: {len(baseline)} porotos en {args.baseline}")
+
+    local_model = None
+    if args.local:
+        if not os.path.exists(args.local):
+            print(f"Error: modelo local {args.local} no encontrado "
+                  "(crealo con: python local_model.py train <salidas.csv>)")
+            sys.exit(1)
+        local_model = LocalModel.load(args.local)
+        print(f"[OK] Modelo local: {len(local_model.classes)} clases, confianza mínima {args.threshold:.0%}")
+
     try:
-        classifier = PorotoclassifierLLM()
+        classifier = PorotoclassifierLLM(cache=cache, pool_size=args.workers, metrics=metrics,
+                                         context_cache=GeminiContextCache(script_dir / ".cache" / "gemini_context.json"),
+                                         compact=args.compact, cascade=args.cascade, samples=args.samples,
+                                         hedge_percentile=args.hedge / 100 if args.hedge else None,
+                                         hedge_budget=args.hedge_budget, stream=args.stream,
+                                         examples=examples, k=args.k,
+                                         local_model=local_model, local_threshold=args.threshold)
     except RuntimeError as e:
         print(f"Error: {e}")
         sys.exit(1)
     print(f"[OK] LLM: {classifier.provider_name}")
+    if args.batch and args.cluster:
+        print("Error: --cluster no está disponible con --batch.")
+        sys.exit(1)
+    if args.batch and (classifier.llm is None or classifier.llm.members[0].provider == "gemini"):
+        print("Error: el modo batch solo está disponible para OpenAI y Groq.")
+        sys.exit(1)
 
     jira_url = os.getenv("JIRA_BASE_URL")
     jira_email = os.getenv("JIRA_EMAIL")
     jira_token = os.getenv("JIRA_API_TOKEN")
     jira = None
     if jira_email and jira_token and jira_url:
-        jira = JiraClient(jira_url, jira_email, jira_token)
+        jira = JiraClient(jira_url, jira_email, jira_token, pool_size=args.jira_workers, metrics=metrics)
         print(f"[OK] Jira: {jira_url}")
+    elif args.jql:
+        print("Error: --jql necesita JIRA_BASE_URL, JIRA_EMAIL y JIRA_API_TOKEN")
+        sys.exit(1)
     else:
         print("[!!] Sin Jira, clasificando solo por titulo")
 
-    porotos = read_input_csv(input_path)
-    print(f"Encontrados: {len(porotos)} porotos\n")
-
-    results = []
-    for poroto in tqdm(porotos, desc="Clasificando", unit="poroto"):
-        key = poroto["key"]
-        title = ""
-        desc = ""
-        labels = []
-        components = []
+    batch_state = f"{os.path.splitext(output_path)[0]}.batch.json"
+    resume = args.resume or (args.batch and os.path.exists(batch_state))
+    journal = ResultJournal(output_path, resume=resume)
+    keys = []
+    if args.jql:
+        print(f"Búsqueda: {args.jql}")
+        if journal.done:
+            print(f"Retomando: {len(journal.done)} ya clasificados en {output_path}")
+    else:
+        porotos = read_input_csv(input_path)
+        print(f"Encontrados: {len(porotos)} porotos")
+        if journal.done:
+            porotos = [p for p in porotos if p["key"] not in journal.done]
+            print(f"Retomando: {len(journal.done)} ya clasificados en {output_path}, faltan {len(porotos)}")
+        keys = [p["key"] for p in porotos]
+    print()
 
+    try:
+        if args.batch:
+            done = run_batch(keys, classifier, jira, journal, batch_state,
+                             jira_workers=args.jira_workers, poll_interval=args.poll, baseline=baseline,
+                             jql=args.jql)
+        else:
+            done = run_pipeline(keys, classifier, jira, journal,
+                                workers=args.workers, jira_workers=args.jira_workers,
+                                batch_size=args.tickets_per_call,
+                                clusters=TitleClusters(args.cluster) if args.cluster else None,
+                                baseline=baseline, jql=args.jql)
+    except JiraSearchError as e:
+        print(f"\nError: Jira rechazó la búsqueda: {e}")
+        sys.exit(1)
+    except JiraUnavailableError as e:
+        print(f"\nError: {e}")
+        print("Lo clasificado hasta acá quedó guardado. Volvé a correr con --resume para seguir desde acá.")
+        sys.exit(1)
+    finally:
+        journal.close()
+        classifier.close()
         if jira:
-            try:
-                d = jira.get_issue_details(key)
-                if d:
-                    title = d["title"]
-                    desc = d["description"]
-                    labels = d["labels"]
-                    components = d["components"]
-            except Exception as e:
-                tqdm.write(f"  [!] Jira {key}: {e}")
-
-        result = classifier.classify(key, title, desc, labels, components)
-        row = {"key": key, "title": title}
-        for f in OUTPUT_FIELDS:
-            row[f] = result.get(f, "")
-        results.append(row)
-
-    save_results(results, output_path)
+            jira.close()
+
     print(f"\nResultado guardado en: {output_path}")
+    print_run_summary(classifier, done, cache)
+    if cache:
+        cache.close()
 
-    counts = {}
-    for r in results:
-        a = r.get("ANTIGUEDAD", "?")
-        counts[a] = counts.get(a, 0) + 1
+    counts = journal.counts
+    total = sum(counts.values())
     print("\nResumen:")
-    for k, v in sorted(counts.items()):
-        print(f"  {k}: {v} ({v/len(results)*100:.0f}%)")
+    for k, v in sorted(counts.items()) if total else []:
+        print(f"  {k}: {v} ({v/total*100:.0f}%)")
 
 
 if __name__ == "__main__":
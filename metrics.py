@@ -0,0 +1,121 @@
+"""Per-ticket timing spans and counters for a classification run.
+
+Stages recorded by the clients:
+    jira        one JQL search (key = first key of the chunk)
+    adf         description extraction from Atlassian Document Format
+    rate_limit  time spent waiting for the provider's rate limiter
+    llm         HTTP latency of one LLM request
+    parse       JSON parse + _normalize of a response
+    ticket      whole classify() of one ticket
+    lote        one multi-ticket request (key = first ticket of the batch)
+Counters: reintentos, 429, errores_llm. Token usage is recorded as "usage"
+events. Everything can be streamed to a JSONL file.
+"""
+
+import json
+import math
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+STAGES = ["jira", "adf", "local", "ejemplos", "rate_limit", "primer_campo", "llm", "parse", "ticket", "lote"]
+
+
+def _percentile(sorted_values, pct):
+    """Nearest-rank percentile: the smallest value with at least pct% of the samples at or below it."""
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[idx]
+
+
+class RunMetrics:
+    def __init__(self, path=None):
+        self.path = path
+        self.durations = defaultdict(list)
+        self.counters = Counter()
+        self.tokens = Counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._file = open(path, "w", encoding="utf-8") if path else None
+
+    @contextmanager
+    def bind(self, key):
+        """Attribute spans recorded in this thread to ticket `key`."""
+        previous = getattr(self._local, "key", None)
+        self._local.key = key
+        try:
+            yield
+        finally:
+            self._local.key = previous
+
+    @property
+    def current_key(self):
+        return getattr(self._local, "key", None)
+
+    def _write(self, record):
+        if self._file:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def record(self, stage, seconds, key=None, **extra):
+        record = {"ts": round(time.time(), 3), "key": key or self.current_key, "stage": stage,
+                  "ms": round(seconds * 1000, 1)} | extra
+        with self._lock:
+            self.durations[stage].append(seconds)
+            self._write(record)
+
+    @contextmanager
+    def span(self, stage, key=None, **extra):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start, key=key, **extra)
+
+    def count(self, name, n=1, key=None):
+        with self._lock:
+            self.counters[name] += n
+            self._write({"ts": round(time.time(), 3), "key": key or self.current_key, "event": name})
+
+    def usage(self, tokens_in, tokens_out, provider=None, tokens_cached=None):
+        with self._lock:
+            self.tokens["in"] += tokens_in or 0
+            self.tokens["out"] += tokens_out or 0
+            self.tokens["cache"] += tokens_cached or 0
+            self._write({"ts": round(time.time(), 3), "key": self.current_key, "event": "usage",
+                         "provider": provider, "tokens_in": tokens_in, "tokens_out": tokens_out,
+                         "tokens_cached": tokens_cached})
+
+    def summary(self):
+        """{stage: {n, p50_ms, p95_ms, p99_ms, total_s}} plus counters and tokens."""
+        with self._lock:
+            stages = {}
+            for stage in STAGES + sorted(set(self.durations) - set(STAGES)):
+                values = sorted(self.durations.get(stage, []))
+                if not values:
+                    continue
+                stages[stage] = {
+                    "n": len(values),
+                    "p50_ms": _percentile(values, 50) * 1000,
+                    "p95_ms": _percentile(values, 95) * 1000,
+                    "p99_ms": _percentile(values, 99) * 1000,
+                    "total_s": sum(values),
+                }
+            return {"etapas": stages, "contadores": dict(self.counters), "tokens": dict(self.tokens)}
+
+    def format_summary(self):
+        data = self.summary()
+        lines = [f"  {'etapa':<11}{'n':>7}{'p50':>10}{'p95':>10}{'p99':>10}{'total':>10}"]
+        for stage, s in data["etapas"].items():
+            lines.append(f"  {stage:<11}{s['n']:>7}{s['p50_ms']:>8.0f}ms{s['p95_ms']:>8.0f}ms"
+                         f"{s['p99_ms']:>8.0f}ms{s['total_s']:>9.1f}s")
+        counters = data["contadores"]
+        lines.append(f"  reintentos: {counters.get('reintentos', 0)}  |  429: {counters.get('429', 0)}"
+                     f"  |  errores LLM: {counters.get('errores_llm', 0)}")
+        return lines
+
+    def close(self):
+        with self._lock:
+            if self._file and not self._file.closed:
+                self._file.close()
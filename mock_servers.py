@@ -0,0 +1,467 @@
+"""Local stand-ins for the Jira and LLM HTTP APIs, for offline benchmarks.
+
+One ThreadingHTTPServer answers:
+    GET  /rest/api/3/issue/{key}
+    POST /rest/api/3/search/jql
+    POST /v1/chat/completions                        (OpenAI / Groq)
+    POST /v1beta/models/{model}:generateContent      (Gemini)
+    POST /v1beta/models/{model}:streamGenerateContent (Gemini, SSE)
+    POST /v1beta/cachedContents                      (Gemini context cache)
+    POST /v1/files, GET /v1/files/{id}/content       (Batch API files)
+    POST /v1/batches, GET /v1/batches/{id}           (Batch API)
+
+Tickets SMPR-1..SMPR-<n_issues> exist and have synthetic titles; a JQL
+without ticket keys matches all of them, paged with nextPageToken. Latency,
+429 injection, malformed-JSON injection, slow stragglers and the RPM/TPM budget advertised in
+x-ratelimit-* headers are set with MockConfig. A batch completes
+`batch_latency` seconds after it is created. Streamed answers ("stream": true
+or streamGenerateContent) send their first chunk after 30% of the latency and
+spread the rest over the remaining 70%; answers list their fields in the
+order of the answer template in the system prompt. Requests that reference a
+cachedContents entry, and OpenAI requests whose system prompt was already
+seen (automatic prefix caching), report the system prompt as cached tokens.
+"""
+
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_TITLES = [
+    "Reingenieria conciliacion Monza {site}",
+    "[Carry Over] Banorte - Dictamen técnico {n}",
+    "[MLM, MLB, MLA] Mastercard Solución reapertura escenarios {n}",
+    "[RollOut] Conexión a versión web 2.0 Izipay {site}",
+    "Conexion via API - BBVA {site} {n}",
+    "AMEX - Compensación comisiones {n}",
+    "[{site}] [A&D] - Promos Bancarias {site} ON/OFF",
+    "TCH en {site} para tener Tokenizacion",
+]
+_SITES = ["MLA", "MLB", "MLM", "MLC", "MCO", "MLU"]
+
+_ANSWERS = {
+    "nuevo": {"ANTIGUEDAD": "Nuevo", "TIPO_DE_PRODUCTO": "Mejora o modificacion de conexion existente",
+              "SCOPE": "Desarrollo", "COMPLEJIDAD": "Poroto abarca solo un flujo",
+              "SCOPE_REFINAMIENTO": "Desarrollo", "JUSTIFICACION": "Mejora sobre un flujo existente."},
+    "na": {"ANTIGUEDAD": "N/A", "TIPO_DE_PRODUCTO": "", "SCOPE": "", "COMPLEJIDAD": "",
+           "SCOPE_REFINAMIENTO": "", "JUSTIFICACION": "No impacta conciliación TMO."},
+}
+
+
+def synthetic_issue(key):
+    n = int(key.split("-")[1])
+    title = _TITLES[n % len(_TITLES)].format(site=_SITES[n % len(_SITES)], n=n)
+    return {
+        "key": key,
+        "fields": {
+            "summary": title,
+            "description": {"type": "doc", "content": [{"type": "paragraph", "content": [
+                {"type": "text", "text": f"Descripción sintética del ticket {key}. " * 8},
+            ]}]},
+            "labels": ["TMO"],
+            "components": [{"name": "Conciliaciones"}],
+            "status": {"name": "Open"},
+            "issuetype": {"name": "Poroto"},
+            "updated": "2026-01-01T00:00:00.000+0000",
+        },
+    }
+
+
+_COMPACT_ANSWERS = {
+    "nuevo": {"A": "N", "T": "M", "S": "D", "F": "1", "J": "Mejora sobre un flujo existente."},
+    "na": {"A": "X", "J": "No impacta conciliación TMO."},
+}
+
+
+_TEMPLATE_RE = re.compile(r'\{"(?:ANTIGUEDAD|A)":[^\n]*\}')
+
+
+def field_order(system_prompt):
+    """Field order of the single-ticket answer template in a system prompt (None if there is none)."""
+    m = _TEMPLATE_RE.search(system_prompt or "")
+    return re.findall(r'"(\w+)":', m.group()) if m else None
+
+
+def mock_answer(user_message, compact=False, order=None):
+    """The canned classification for a user message (or a batch of them), with its fields in
+    `order` when given, like a model following the prompt's template."""
+    answers, ticket_field = (_COMPACT_ANSWERS, "K") if compact else (_ANSWERS, "TICKET")
+
+    def one(text):
+        answer = dict(answers["na" if "Compensación" in text else "nuevo"])
+        if order:
+            answer = {f: answer[f] for f in order if f in answer} | answer
+        m = re.search(r"Ticket: (\S+)", text)
+        return answer, (m.group(1) if m else "")
+
+    if "=== Ticket " in user_message:
+        items = []
+        for part in user_message.split("=== Ticket ")[1:]:
+            answer, key = one(part)
+            items.append({ticket_field: key} | answer)
+        return {"resultados": items}
+    return one(user_message)[0]
+
+
+class MockConfig:
+    def __init__(self, n_issues=10000, jira_latency=0.2, llm_latency=0.4, jitter=0.3,
+                 rate_429=0.0, malformed=0.0, stragglers=0.0, straggler_latency=10.0,
+                 rpm=6000, tpm=2000000, batch_latency=2.0, seed=0):
+        self.n_issues = n_issues
+        self.jira_latency = jira_latency
+        self.llm_latency = llm_latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.malformed = malformed
+        self.stragglers = stragglers
+        self.straggler_latency = straggler_latency
+        self.rpm = rpm
+        self.tpm = tpm
+        self.batch_latency = batch_latency
+        self.seed = seed
+
+
+class _Budget:
+    """Sliding one-minute window used for the x-ratelimit-* headers."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.events = deque()
+        self.used = 0
+
+    def _expire(self, now):
+        while self.events and now - self.events[0][0] >= 60:
+            self.used -= self.events.popleft()[1]
+
+    def take(self, amount, now):
+        self._expire(now)
+        if self.used + amount > self.limit:
+            return False
+        self.events.append((now, amount))
+        self.used += amount
+        return True
+
+    def headers(self, kind, now):
+        self._expire(now)
+        reset = 60 - (now - self.events[0][0]) if self.events else 0.001
+        return {
+            f"x-ratelimit-limit-{kind}": str(self.limit),
+            f"x-ratelimit-remaining-{kind}": str(max(0, self.limit - self.used)),
+            f"x-ratelimit-reset-{kind}": f"{reset:.3f}s",
+        }
+
+
+class MockServer:
+    def __init__(self, config=None):
+        self.config = config or MockConfig()
+        self.stats = Counter()
+        self.random = random.Random(self.config.seed)
+        self.lock = threading.Lock()
+        self.requests_budget = _Budget(self.config.rpm)
+        self.tokens_budget = _Budget(self.config.tpm)
+        self.files = {}
+        self.batches = {}
+        self.cached_contents = {}
+        self.seen_prefixes = set()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    @property
+    def openai_url(self):
+        return f"{self.url}/v1/chat/completions"
+
+    @property
+    def gemini_url(self):
+        return self.url + "/v1beta/models/{model}:generateContent"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="mock-server", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _latency(self, base):
+        with self.lock:
+            factor = 1 + self.random.uniform(-self.config.jitter, self.config.jitter)
+        return max(0.0, base * factor)
+
+    def _sleep(self, base):
+        time.sleep(self._latency(base))
+
+    def _roll(self, probability):
+        with self.lock:
+            return self.random.random() < probability
+
+    def _answer_text(self, system, user):
+        """A canned answer, truncated when malformed-JSON injection hits."""
+        text = json.dumps(mock_answer(user, compact="FORMATO COMPACTO" in system, order=field_order(system)),
+                          ensure_ascii=False)
+        if self._roll(self.config.malformed):
+            self.stats["llm_malformed"] += 1
+            text = text[: len(text) * 2 // 3]
+        return text
+
+    def _add_file(self, content):
+        with self.lock:
+            file_id = f"file-{len(self.files) + 1}"
+            self.files[file_id] = content
+        return file_id
+
+    def _batch(self, batch_id):
+        """The batch object, running it once batch_latency has passed."""
+        with self.lock:
+            batch = self.batches.get(batch_id)
+        if batch is None or batch["status"] == "completed":
+            return batch
+        if time.time() - batch["created_at"] < self.config.batch_latency:
+            batch["status"] = "in_progress"
+            return batch
+
+        lines = []
+        for line in self.files[batch["input_file_id"]].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            messages = request["body"]["messages"]
+            text = self._answer_text(messages[0]["content"], messages[1]["content"])
+            self.stats["llm_batch"] += 1
+            lines.append(json.dumps({
+                "id": f"req-{len(lines) + 1}",
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "body": {
+                    "choices": [{"message": {"role": "assistant", "content": text}}],
+                }},
+                "error": None,
+            }, ensure_ascii=False))
+        batch["output_file_id"] = self._add_file(("\n".join(lines) + "\n").encode("utf-8"))
+        batch["request_counts"] = {"total": len(lines), "completed": len(lines), "failed": 0}
+        batch["status"] = "completed"
+        return batch
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, code, body=b"", headers=None, content_type="application/json"):
+                if not isinstance(body, bytes):
+                    body = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _raw(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return self.rfile.read(length)
+
+            def _body(self):
+                return json.loads(self._raw() or b"{}")
+
+            def do_GET(self):
+                m = re.match(r"/v1/files/([\w-]+)/content", self.path)
+                if m:
+                    content = server.files.get(m.group(1))
+                    if content is None:
+                        return self._send(404, {})
+                    return self._send(200, content, content_type="application/jsonl")
+                m = re.match(r"/v1/batches/([\w-]+)", self.path)
+                if m:
+                    batch = server._batch(m.group(1))
+                    return self._send(200, batch) if batch else self._send(404, {})
+
+                m = re.match(r"/rest/api/3/issue/([A-Z]+-\d+)", self.path)
+                if not m:
+                    return self._send(404, {})
+                server.stats["jira_get"] += 1
+                server._sleep(server.config.jira_latency)
+                key = m.group(1)
+                if int(key.split("-")[1]) > server.config.n_issues:
+                    return self._send(404, {"errorMessages": ["Issue does not exist"]})
+                self._send(200, synthetic_issue(key))
+
+            def do_POST(self):
+                if self.path.startswith("/rest/api/3/search/jql"):
+                    return self._jira_search(self._body())
+                if self.path.startswith("/v1/chat/completions"):
+                    return self._llm(self._body(), gemini=False)
+                if self.path.startswith("/v1beta/cachedContents"):
+                    return self._create_cached_content(self._body())
+                if ":generateContent" in self.path or ":streamGenerateContent" in self.path:
+                    return self._llm(self._body(), gemini=True)
+                if self.path.startswith("/v1/files"):
+                    return self._upload(self._raw())
+                if self.path.startswith("/v1/batches"):
+                    return self._create_batch(self._body())
+                self._send(404, {})
+
+            def _upload(self, raw):
+                boundary = self.headers.get("Content-Type", "").split("boundary=")[-1].strip('"').encode()
+                for part in raw.split(b"--" + boundary):
+                    head, _, content = part.partition(b"\r\n\r\n")
+                    if b'name="file"' in head:
+                        file_id = server._add_file(content.rsplit(b"\r\n", 1)[0])
+                        return self._send(200, {"id": file_id, "object": "file", "purpose": "batch"})
+                self._send(400, {"error": "missing file"})
+
+            def _create_batch(self, body):
+                if body.get("input_file_id") not in server.files:
+                    return self._send(400, {"error": "unknown input_file_id"})
+                with server.lock:
+                    batch_id = f"batch-{len(server.batches) + 1}"
+                    batch = {"id": batch_id, "object": "batch", "status": "validating",
+                             "input_file_id": body["input_file_id"], "endpoint": body.get("endpoint"),
+                             "created_at": time.time(), "output_file_id": None, "error_file_id": None,
+                             "request_counts": {"total": 0, "completed": 0, "failed": 0}}
+                    server.batches[batch_id] = batch
+                self._send(200, batch)
+
+            def _jira_search(self, body):
+                server.stats["jira_search"] += 1
+                server._sleep(server.config.jira_latency)
+                keys = re.findall(r"[A-Z]+-\d+", body.get("jql", ""))
+                if not keys:
+                    start = int(body.get("nextPageToken") or 1)
+                    end = min(start + body.get("maxResults", 50), server.config.n_issues + 1)
+                    page = {"issues": [synthetic_issue(f"SMPR-{n}") for n in range(start, end)],
+                            "isLast": end > server.config.n_issues}
+                    if not page["isLast"]:
+                        page["nextPageToken"] = str(end)
+                    return self._send(200, page)
+                missing = [k for k in keys if int(k.split("-")[1]) > server.config.n_issues]
+                if missing:
+                    return self._send(400, {"errorMessages": [
+                        f"An issue with key '{k}' does not exist for field 'key'." for k in missing
+                    ]})
+                self._send(200, {"issues": [synthetic_issue(k) for k in keys], "isLast": True})
+
+            def _create_cached_content(self, body):
+                with server.lock:
+                    name = f"cachedContents/{len(server.cached_contents) + 1}"
+                    server.cached_contents[name] = body["systemInstruction"]["parts"][0]["text"]
+                server.stats["gemini_cache"] += 1
+                expire = time.strftime("%Y-%m-%dT%H:%M:%S.000000Z", time.gmtime(time.time() + 3600))
+                self._send(200, {"name": name, "model": body.get("model"), "expireTime": expire})
+
+            def _llm(self, body, gemini):
+                if gemini:
+                    if "cachedContent" in body:
+                        system = server.cached_contents.get(body["cachedContent"])
+                        if system is None:
+                            return self._send(404, {"error": {"message": "CachedContent not found"}})
+                        cached = True
+                    else:
+                        system = body.get("system_instruction", {}).get("parts", [{}])[0].get("text", "")
+                        cached = False
+                    user = body["contents"][0]["parts"][0]["text"]
+                    max_tokens = body.get("generationConfig", {}).get("maxOutputTokens", 300)
+                else:
+                    system, user = body["messages"][0]["content"], body["messages"][1]["content"]
+                    max_tokens = body.get("max_tokens", 300)
+                    with server.lock:
+                        cached = system in server.seen_prefixes
+                        server.seen_prefixes.add(system)
+                prompt_tokens = (len(system) + len(user)) // 4
+                cached_tokens = len(system) // 4 if cached else 0
+
+                now = time.monotonic()
+                with server.lock:
+                    server.stats["llm"] += 1
+                    allowed = (server.requests_budget.take(1, now)
+                               and server.tokens_budget.take(prompt_tokens + max_tokens, now))
+                    headers = (server.requests_budget.headers("requests", now)
+                               | server.tokens_budget.headers("tokens", now))
+                if not allowed or server._roll(server.config.rate_429):
+                    server.stats["llm_429"] += 1
+                    return self._send(429, {"error": "rate limited"}, headers | {"retry-after": "1"})
+
+                base = server.config.llm_latency
+                if server._roll(server.config.stragglers):
+                    server.stats["llm_lento"] += 1
+                    base = server.config.straggler_latency
+                latency = server._latency(base)
+                text = server._answer_text(system, user)
+                completion_tokens = len(text) // 4
+                usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                         "total_tokens": prompt_tokens + completion_tokens,
+                         "prompt_tokens_details": {"cached_tokens": cached_tokens}}
+                if body.get("stream") or ":streamGenerateContent" in self.path:
+                    return self._stream(text, latency, usage, headers, gemini)
+
+                time.sleep(latency)
+
+                if gemini:
+                    return self._send(200, {
+                        "candidates": [{"content": {"parts": [{"text": text}]}}],
+                        "usageMetadata": {"promptTokenCount": prompt_tokens,
+                                          "candidatesTokenCount": completion_tokens,
+                                          "totalTokenCount": prompt_tokens + completion_tokens,
+                                          "cachedContentTokenCount": cached_tokens},
+                    }, headers)
+                self._send(200, {
+                    "choices": [{"message": {"role": "assistant", "content": text}}],
+                    "usage": usage,
+                }, headers)
+
+            def _stream(self, text, latency, usage, headers, gemini):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+                self.send_header("Connection", "close")
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.close_connection = True
+
+                pieces = [text[k:k + 6] for k in range(0, len(text), 6)]
+                events = []
+                for piece in pieces:
+                    if gemini:
+                        events.append({"candidates": [{"content": {"parts": [{"text": piece}]}}]})
+                    else:
+                        events.append({"choices": [{"delta": {"content": piece}}]})
+                if gemini:
+                    events.append({"usageMetadata": {
+                        "promptTokenCount": usage["prompt_tokens"],
+                        "candidatesTokenCount": usage["completion_tokens"],
+                        "totalTokenCount": usage["total_tokens"],
+                        "cachedContentTokenCount": usage["prompt_tokens_details"]["cached_tokens"],
+                    }})
+                else:
+                    events.append({"choices": [], "usage": usage})
+
+                time.sleep(latency * 0.3)
+                try:
+                    for event in events:
+                        self.wfile.write(b"data: " + json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n\n")
+                        self.wfile.flush()
+                        time.sleep(latency * 0.7 / len(events))
+                    if not gemini:
+                        self.wfile.write(b"data: [DONE]\n\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    server.stats["llm_stream_cortado"] += 1
+
+        return Handler
@@ -0,0 +1,163 @@
+"""Stages of the CLI run: Jira prefetch (by key or JQL) -> LLM classification -> CSV writer.
+
+Each stage runs in its own threads and hands work to the next one through a
+bounded queue, so Jira latency overlaps with LLM latency instead of adding
+up. The classification stage itself is PorotoclassifierLLM.iter_classify.
+"""
+
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+_DONE = object()
+
+
+def _put(q, item, stop):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.2)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def jira_stage(jira, keys, workers=2, queue_size=200, progress=None, on_error=None):
+    """Yield ticket details for `keys`, in order, fetched ahead by `workers` threads.
+
+    Keys are fetched in chunks of jira.page_size with get_issues_details and
+    at most `queue_size` tickets wait for the consumer. Tickets Jira does not
+    return (or whose chunk failed) come out as {"key": key, "title": ""}.
+    `jira` may be None, in which case every ticket comes out empty.
+    """
+    keys = list(keys)
+    if jira is None:
+        for key in keys:
+            if progress is not None:
+                progress.update(1)
+            yield {"key": key, "title": ""}
+        return
+
+    q = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+
+    def fetch(chunk):
+        try:
+            return jira.get_issues_details(chunk, on_error=on_error)
+        except Exception as e:
+            if on_error:
+                on_error(chunk, e)
+            return {}
+
+    def produce():
+        try:
+            chunks = [keys[i:i + jira.page_size] for i in range(0, len(keys), jira.page_size)]
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                pending = deque()
+                for chunk in chunks:
+                    pending.append((chunk, pool.submit(fetch, chunk)))
+                    if len(pending) < workers:
+                        continue
+                    if not _emit(*pending.popleft()):
+                        return
+                while pending:
+                    if not _emit(*pending.popleft()):
+                        return
+        except Exception as e:
+            errors.append(e)
+        finally:
+            _put(q, _DONE, stop)
+
+    def _emit(chunk, future):
+        details = future.result()
+        for key in chunk:
+            if not _put(q, details.get(key) or {"key": key, "title": ""}, stop):
+                return False
+            if progress is not None:
+                progress.update(1)
+        return True
+
+    producer = threading.Thread(target=produce, name="jira-stage", daemon=True)
+    yield from _consume(q, stop, producer, errors)
+
+
+def jql_stage(jira, jql, skip=(), queue_size=200, progress=None):
+    """Yield ticket details for every issue matching `jql`, in Jira's order.
+
+    A thread walks the search pages (JiraClient.iter_search) ahead of the
+    consumer, so classification starts with the first page and at most
+    `queue_size` tickets plus one page are held at a time. Keys in `skip`
+    (e.g. already in a resumed output) are left out.
+    """
+    q = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+
+    def produce():
+        try:
+            for ticket in jira.iter_search(jql):
+                if progress is not None:
+                    progress.update(1)
+                if ticket["key"] in skip:
+                    continue
+                if not _put(q, ticket, stop):
+                    return
+        except Exception as e:
+            errors.append(e)
+        finally:
+            _put(q, _DONE, stop)
+
+    producer = threading.Thread(target=produce, name="jql-stage", daemon=True)
+    yield from _consume(q, stop, producer, errors)
+
+
+def _consume(q, stop, producer, errors):
+    producer.start()
+    try:
+        while True:
+            item = q.get()
+            if item is _DONE:
+                break
+            yield item
+    finally:
+        stop.set()
+        producer.join(timeout=5)
+    if errors:
+        raise errors[0]
+
+
+class WriterStage:
+    """Single thread draining result rows into a ResultJournal."""
+
+    def __init__(self, journal, queue_size=200, progress=None):
+        self.journal = journal
+        self.progress = progress
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name="writer-stage", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            row = self.queue.get()
+            if row is _DONE:
+                return
+            try:
+                self.journal.write(row)
+            except Exception as e:
+                self.error = self.error or e
+            if self.progress is not None:
+                self.progress.update(1)
+
+    def put(self, row):
+        if self.error:
+            raise self.error
+        self.queue.put(row)
+
+    def close(self):
+        self.queue.put(_DONE)
+        self.thread.join()
+        if self.error:
+            raise self.error
@@ -0,0 +1,184 @@
+import re
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread-safe token bucket shared by every worker talking to one provider.
+
+    `rate` is in requests per second and `capacity` is the largest burst allowed.
+    `pause` blocks all workers at once, e.g. after a 429 with retry-after.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Block until a request may be sent. Returns the seconds spent waiting."""
+        start = time.monotonic()
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return now - start
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def delay(self):
+        """Seconds until acquire() would return, without taking a token."""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            token_wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+            return max(self.blocked_until - now, token_wait, 0.0)
+
+    def pause(self, seconds):
+        """Stop handing out tokens for `seconds` across all workers."""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.blocked_until = max(self.blocked_until, now + seconds)
+            self.tokens = 0
+
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)?")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, None: 1}
+
+
+def parse_duration(value):
+    """Parse reset headers like "2m59.56s", "7.66s", "20ms" or "3" into seconds."""
+    if value is None:
+        return None
+    total, matched = 0.0, False
+    for number, unit in _DURATION_RE.findall(str(value).strip()):
+        total += float(number) * _DURATION_UNITS[unit or None]
+        matched = True
+    return total if matched else None
+
+
+def _header_float(headers, name):
+    try:
+        return float(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveRateLimiter(TokenBucket):
+    """TokenBucket whose rate follows the provider, plus a tokens-per-minute budget.
+
+    - acquire(cost) waits for a request slot *and* `cost` tokens of the TPM
+      budget (prompt + message + max_tokens, estimated locally), which refills
+      at tpm/60 per second.
+    - observe(headers, usage) reads x-ratelimit-{limit,remaining,reset}-*:
+      the request rate is capped at what the remaining requests allow until
+      the reset, the TPM budget is learned from the limit and never trusted
+      above what the server says remains. An exhausted budget pauses until
+      its reset.
+    - AIMD: every success adds `increase` req/s up to that cap, every 429
+      halves the rate. Until request headers have been seen the cap is
+      `max_rate`, by default the starting rate: providers that send no
+      headers (Gemini) keep their documented pacing instead of being pushed
+      into 429s.
+    """
+
+    SAFETY = 0.9
+
+    def __init__(self, rate, tokens_per_minute=None, min_rate=None, max_rate=None, increase=None, capacity=1):
+        super().__init__(rate, capacity)
+        self.min_rate = min_rate or rate / 8
+        self.max_rate = max_rate or rate
+        self.increase = increase or rate / 10
+        self.ceiling = self.max_rate
+        self.tpm = tokens_per_minute
+        self.token_budget = tokens_per_minute or 0
+
+    @property
+    def current_rate(self):
+        return self.rate
+
+    def _refill(self, now):
+        if self.tpm:
+            self.token_budget = min(self.tpm, self.token_budget + (now - self.updated) * self.tpm / 60)
+        super()._refill(now)
+
+    def _wait(self, now, cost):
+        wait = max(self.blocked_until - now, 0.0)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        if self.tpm and cost:
+            cost = min(cost, self.tpm)
+            if self.token_budget < cost:
+                wait = max(wait, (cost - self.token_budget) * 60 / self.tpm)
+        return wait
+
+    def acquire(self, cost=0):
+        start = time.monotonic()
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._wait(now, cost)
+                if wait <= 0:
+                    self.tokens -= 1
+                    if self.tpm:
+                        self.token_budget -= min(cost, self.tpm)
+                    return now - start
+            time.sleep(wait)
+
+    def delay(self, cost=0):
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            return self._wait(now, cost)
+
+    def observe(self, headers, usage=None):
+        headers = headers or {}
+        pause = 0.0
+        with self.lock:
+            self._refill(time.monotonic())
+
+            limit_tokens = _header_float(headers, "x-ratelimit-limit-tokens")
+            if limit_tokens:
+                if not self.tpm:
+                    self.token_budget = limit_tokens
+                self.tpm = limit_tokens
+            remaining_tokens = _header_float(headers, "x-ratelimit-remaining-tokens")
+            if remaining_tokens is not None and self.tpm:
+                self.token_budget = min(self.token_budget, remaining_tokens)
+                if remaining_tokens < 1:
+                    pause = max(pause, parse_duration(headers.get("x-ratelimit-reset-tokens")) or 0)
+
+            remaining = _header_float(headers, "x-ratelimit-remaining-requests")
+            reset = parse_duration(headers.get("x-ratelimit-reset-requests"))
+            if remaining is not None and reset:
+                if remaining < 1:
+                    pause = max(pause, reset)
+                else:
+                    self.ceiling = max(self.min_rate, remaining / reset * self.SAFETY)
+                    self.rate = min(self.rate, self.ceiling)
+        if pause:
+            self.pause(pause)
+
+    def on_success(self):
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = min(self.rate + self.increase, self.ceiling)
+
+    def on_throttle(self, wait_seconds):
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.rate / 2, self.min_rate)
+        self.pause(wait_seconds)
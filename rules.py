@@ -0,0 +1,51 @@
+"""Deterministic title rules taken from SYSTEM_PROMPT, applied before the LLM."""
+
+import re
+
+SITE_CODES = ("MLA", "MLB", "MLM", "MLC", "MCO", "MLU", "MEC", "MPE")
+
+_CARRY_OVER_RE = re.compile(r"\bcarry[\s_-]*over\b", re.IGNORECASE)
+_AD_RE = re.compile(r"\[\s*A\s*&\s*D\s*\]", re.IGNORECASE)
+_ROLLOUT_RE = re.compile(r"\[\s*(?:scope\s*:\s*)?roll[\s-]*out\s*\]", re.IGNORECASE)
+_SCOPE_TAG_RE = re.compile(r"\[\s*scope\s*:\s*(an[aá]lisis|desarrollo)\s*\]", re.IGNORECASE)
+_SITE_RE = re.compile(r"\b(" + "|".join(SITE_CODES) + r")\b")
+_ALL_SITES_RE = re.compile(
+    r"\ball\s+(?:the\s+)?sites\b|\bcross[\s-]*sites?\b|\bmulti[\s-]*sites?\b|\btodos\s+los\s+sites\b",
+    re.IGNORECASE,
+)
+
+_SCOPE_TAGS = {"analisis": "Analisis", "análisis": "Analisis", "desarrollo": "Desarrollo"}
+
+
+def find_sites(text):
+    """Distinct site codes mentioned in text, in order of appearance."""
+    return list(dict.fromkeys(_SITE_RE.findall(text or "")))
+
+
+def pre_classify(title):
+    """Apply the string rules to a ticket title.
+
+    Returns (result, pinned). `result` is a full classification when the rules
+    alone decide it (Carry Over), else None. `pinned` holds the fields the rules
+    fix for a "Nuevo" ticket; _normalize enforces them over the model's answer.
+    """
+    title = title or ""
+    if _CARRY_OVER_RE.search(title):
+        return {
+            "ANTIGUEDAD": "Carry Over",
+            "JUSTIFICACION": "El título indica Carry Over (continuación de un Q anterior).",
+        }, {}
+
+    pinned = {}
+    if _AD_RE.search(title):
+        pinned["SCOPE"] = "Analisis y Desarrollo"
+    elif _ROLLOUT_RE.search(title):
+        pinned["SCOPE"] = "Soporte"
+    else:
+        m = _SCOPE_TAG_RE.search(title)
+        if m:
+            pinned["SCOPE"] = _SCOPE_TAGS[m.group(1).lower()]
+
+    if len(find_sites(title)) >= 2 or _ALL_SITES_RE.search(title):
+        pinned["COMPLEJIDAD"] = "Poroto abarca mas de un flujo"
+    return None, pinned
@@ -0,0 +1,35 @@
+"""Local token estimates, close enough to budget TPM without a tokenizer."""
+
+import re
+
+_PIECE_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+def estimate_tokens(text):
+    """Rough token count for Llama/GPT-style BPE on Spanish/English text.
+
+    Words average ~4 characters per token and every punctuation mark is its
+    own token; this overshoots slightly, which is the safe side for a budget.
+    """
+    if not text:
+        return 0
+    tokens = 0
+    for piece in _PIECE_RE.findall(text):
+        tokens += 1 if len(piece) <= 4 else (len(piece) + 3) // 4
+    return tokens
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text to about max_tokens, at a whitespace boundary."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    cut = text[:lo]
+    space = cut.rfind(" ")
+    return cut[:space] if space > lo * 0.8 else cut